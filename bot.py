@@ -2,6 +2,7 @@ import logging
 from aiogram import Bot, Dispatcher
 from aiogram.types import BotCommandScopeDefault, BotCommand
 from aiogram import types
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from config import cfg
 from db import init_db
@@ -10,16 +11,35 @@ from handlers.roles_handler import router as roles_router
 from handlers.nicks_handler import router as nicks_router
 from handlers.warns_handler import router as warns_router
 from handlers.raven_handler import router as raven_router
-from db import AsyncSessionLocal
-from models import Chat, RoleAssignment
-from sqlalchemy import select
+from db import AsyncSessionLocal, engine
+from middlewares.admission import AdmissionMiddleware
+from middlewares.antiflood import AntiFloodMiddleware
+from middlewares.commands import CommandMiddleware
+from middlewares.db_session import DbSessionMiddleware
+from middlewares.member_names import MemberNamesMiddleware
+from middlewares.metrics import ApiMetricsMiddleware, HandlerLabelMiddleware, UpdateMetricsMiddleware
+from middlewares.querywatch import QueryWatchMiddleware, watch_engine
+from middlewares.scheduler import ChatSchedulerMiddleware
+from services.adminlist import admin_lists
+from services.antiflood import antiflood
+from services.adminsync import admin_sync
+from services.chats import chat_registry
+from services.expiry import warn_expiry
+from services.metrics import instrument_engine, metrics, start_metrics_server
+from services.names import member_names
+from services.outbox import outbox
+from services.roles import role_index
+from services.writebuffer import warn_writes
+from upserts import upsert_role
+from webhook import run_webhook
+from workers import run_partitioned
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
 bot = Bot(token=cfg.BOT_TOKEN)
-dp = Dispatcher()
+dp = Dispatcher(name="root")
 
 
 dp.include_router(start_router)
@@ -28,8 +48,50 @@ dp.include_router(nicks_router)
 dp.include_router(warns_router)
 dp.include_router(raven_router)
 
+if cfg.METRICS_PORT:
+    # registered first so the timing covers the other middlewares too
+    dp.update.outer_middleware(UpdateMetricsMiddleware())
+    for event_name, observer in dp.observers.items():
+        if event_name not in ("update", "error"):
+            observer.middleware(HandlerLabelMiddleware())
+    bot.session.middleware(ApiMetricsMiddleware())
+    instrument_engine(engine)
+
+if cfg.QUERY_WATCH != "off":
+    for event_name, observer in dp.observers.items():
+        if event_name not in ("update", "error"):
+            observer.middleware(QueryWatchMiddleware(cfg.QUERY_WATCH, cfg.QUERY_WATCH_LIMIT, cfg.QUERY_WATCH_BUDGET))
+    watch_engine(engine)
+
+# admission and scheduling come before anything that awaits, so updates reach them in arrival order;
+# names, recent authors and the anti-flood also see the messages that get shed during a raid
+scheduler = ChatSchedulerMiddleware(cfg.HANDLER_MAX_CONCURRENCY)
+admission = AdmissionMiddleware(scheduler, cfg.ADMISSION_CHAT_LIMIT, cfg.ADMISSION_HIGH_WATER)
+dp.update.outer_middleware(MemberNamesMiddleware())
+if antiflood is not None:
+    dp.update.outer_middleware(AntiFloodMiddleware(antiflood))
+dp.update.outer_middleware(admission)
+dp.update.outer_middleware(scheduler)
+if cfg.METRICS_PORT:
+    metrics.add_collector(admission.collect)
+    if antiflood is not None:
+        metrics.add_collector(antiflood.collect)
+dp.message.outer_middleware(CommandMiddleware())
+# one lazily connected session per update for handlers that ask for `session`
+for event_name, observer in dp.observers.items():
+    if event_name not in ("update", "error"):
+        observer.middleware(DbSessionMiddleware(AsyncSessionLocal))
+
+
+@dp.chat_member()
+async def on_chat_member(update: types.ChatMemberUpdated):
+    # Name or membership changed -- forget the cached display name
+    member_names.invalidate(update.chat.id, update.new_chat_member.user.id)
+    admin_lists.bump(update.chat.id)
+
+
 @dp.my_chat_member()
-async def on_my_chat_member(update: types.ChatMemberUpdated):
+async def on_my_chat_member(update: types.ChatMemberUpdated, bot: Bot, session: AsyncSession):
 
     try:
 
@@ -37,13 +99,7 @@ async def on_my_chat_member(update: types.ChatMemberUpdated):
         if chat is None:
             return
 
-        async with AsyncSessionLocal() as session:
-            q = await session.execute(select(Chat).where(Chat.id == chat.id))
-            ch = q.scalars().first()
-            if not ch:
-                ch = Chat(id=chat.id)
-                session.add(ch)
-                await session.commit()
+        await chat_registry.ensure(chat.id)
 
         try:
             admins = await bot.get_chat_administrators(chat.id)
@@ -59,18 +115,12 @@ async def on_my_chat_member(update: types.ChatMemberUpdated):
                 break
 
         if owner:
-            async with AsyncSessionLocal() as session:
-                # assign owner role (5)
-                q = await session.execute(select(RoleAssignment).where(RoleAssignment.chat_id == chat.id, RoleAssignment.user_id == owner.id))
-                existing = q.scalars().first()
-                if existing:
-                    existing.role_id = 5
-                    session.add(existing)
-                else:
-                    ra = RoleAssignment(chat_id=chat.id, user_id=owner.id, role_id=5, assigned_by=None)
-                    session.add(ra)
-                await session.commit()
-                logger.info("Assigned owner role in chat %s to user %s", chat.id, owner.id)
+            # assign owner role (5)
+            await upsert_role(session, chat.id, owner.id, 5)
+            await session.commit()
+            role_index.set(chat.id, owner.id, 5)
+            admin_lists.bump(chat.id)
+            logger.info("Assigned owner role in chat %s to user %s", chat.id, owner.id)
     except Exception as e:
         logger.exception("Error in on_my_chat_member: %s", e)
 
@@ -86,11 +136,35 @@ async def main():
     ]
     await bot.set_my_commands(commands, scope=BotCommandScopeDefault())
 
-    # start polling
+    if cfg.WORKERS > 1:
+        # updates are handled by worker processes, each with its own dp/engine
+        try:
+            await run_partitioned(dp, bot)
+        finally:
+            await bot.session.close()
+        return
+
+    await chat_registry.load()
+    warn_expiry.start()
+    admin_sync.start(bot)
+    metrics_runner = await start_metrics_server() if cfg.METRICS_PORT else None
+
     try:
-        await dp.start_polling(bot)
+        if cfg.UPDATE_MODE == "webhook":
+            await run_webhook(dp, bot)
+        else:
+            # start polling
+            await dp.start_polling(bot)
     finally:
+        await warn_expiry.stop()
+        await admin_sync.stop()
+        if antiflood is not None:
+            await antiflood.close()
+        await warn_writes.close()
+        await outbox.close()
         await bot.session.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
 
 
 if __name__ == "__main__":
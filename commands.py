@@ -0,0 +1,82 @@
+"""
+Text command registry.
+
+Chat commands are plain words ("+пред", "админы", ...). Instead of every handler
+running its own regex on every message, the first word is looked up once in a
+dict (see middlewares.commands.CommandMiddleware) and the matching Cmd filter
+gets the parsed tokens. Two handlers claiming the same word is an error raised
+while the routers are imported, i.e. when the bot starts.
+"""
+from typing import Dict, List, NamedTuple, Optional
+
+from aiogram.filters import Filter
+from aiogram.types import Message
+
+
+class ParsedCommand(NamedTuple):
+    word: str          # lower-cased first token, e.g. "+пред"
+    args: List[str]    # remaining whitespace separated tokens
+    owner: "Cmd"       # filter that registered the word
+
+
+class CommandRegistry:
+    def __init__(self):
+        # word -> [owner when the word comes alone, owner when it has arguments]
+        self._table: Dict[str, list] = {}
+
+    def register(self, owner: "Cmd", word: str, args: Optional[bool] = None):
+        word = word.lower()
+        slot = self._table.setdefault(word, [None, None])
+        arities = (False, True) if args is None else (args,)
+        for has_args in arities:
+            other = slot[has_args]
+            if other is not None and other is not owner:
+                raise ValueError(f"Command {word!r} is claimed by both {other!r} and {owner!r}")
+            slot[has_args] = owner
+
+    def match(self, text: Optional[str]) -> Optional[ParsedCommand]:
+        if not text:
+            return None
+        parts = text.split()
+        if not parts:
+            return None
+        slot = self._table.get(parts[0].lower())
+        if slot is None:
+            return None
+        owner = slot[len(parts) > 1]
+        if owner is None:
+            return None
+        return ParsedCommand(parts[0].lower(), parts[1:], owner)
+
+
+registry = CommandRegistry()
+
+_UNPARSED = object()
+
+
+class Cmd(Filter):
+    """
+    Matches messages whose first word is one of `words`.
+    args=True/False restricts the match to messages with/without arguments.
+    The handler receives the parsed tokens as `cmd: ParsedCommand`.
+    """
+
+    def __init__(self, *words: str, args: Optional[bool] = None):
+        self.words = words
+        self.args = args
+        for word in words:
+            registry.register(self, word, args)
+
+    def __repr__(self):
+        words = ", ".join(repr(w) for w in self.words)
+        if self.args is None:
+            return f"Cmd({words})"
+        return f"Cmd({words}, args={self.args})"
+
+    async def __call__(self, message: Message, cmd=_UNPARSED):
+        if cmd is _UNPARSED:
+            # CommandMiddleware is not installed (e.g. router used standalone)
+            cmd = registry.match(message.text)
+        if cmd is None or cmd.owner is not self:
+            return False
+        return {"cmd": cmd}
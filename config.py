@@ -12,8 +12,92 @@ class Config:
     DATABASE_URL: str = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///woxl.db")
     PARSE_MODE: str = "HTML"
 
+    # Connection pool (see db.engine_options)
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "5"))
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+    DB_POOL_TIMEOUT: float = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+    DB_POOL_RECYCLE: int = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+    # SQLite connection PRAGMAs
+    SQLITE_BUSY_TIMEOUT_MS: int = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "15000"))
+    SQLITE_CACHE_SIZE_KB: int = int(os.getenv("SQLITE_CACHE_SIZE_KB", "20000"))
+    SQLITE_MMAP_SIZE: int = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+    # Max parallel get_chat_member calls when resolving a page of names
+    NAME_LOOKUP_CONCURRENCY: int = int(os.getenv("NAME_LOOKUP_CONCURRENCY", "8"))
+    # In-process cache of member display names (entries, seconds)
+    NAME_CACHE_SIZE: int = int(os.getenv("NAME_CACHE_SIZE", "10000"))
+    NAME_CACHE_TTL: int = int(os.getenv("NAME_CACHE_TTL", "3600"))
+    # Rendered admin lists kept in memory (chats); entries live NAME_CACHE_TTL seconds
+    ADMIN_LIST_CACHE_SIZE: int = int(os.getenv("ADMIN_LIST_CACHE_SIZE", "2000"))
+
     CREATOR_IDS_RAW: str = os.getenv("CREATOR_IDS", "")
 
+    # Outbound rate limits: messages/second overall and per chat (Telegram allows ~30/s and ~20/min per group)
+    OUTBOX_GLOBAL_RATE: float = float(os.getenv("OUTBOX_GLOBAL_RATE", "30"))
+    OUTBOX_CHAT_RATE: float = float(os.getenv("OUTBOX_CHAT_RATE", "0.33"))
+    OUTBOX_CHAT_BURST: float = float(os.getenv("OUTBOX_CHAT_BURST", "5"))
+    OUTBOX_MAX_RETRIES: int = int(os.getenv("OUTBOX_MAX_RETRIES", "3"))
+
+    # /send_raven_bot all: parallel sends, chats loaded per DB query, seconds between status edits
+    BROADCAST_CONCURRENCY: int = int(os.getenv("BROADCAST_CONCURRENCY", "20"))
+    BROADCAST_CHUNK_SIZE: int = int(os.getenv("BROADCAST_CHUNK_SIZE", "500"))
+    BROADCAST_PROGRESS_INTERVAL: float = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "5"))
+
+    # Owner sync with Telegram: seconds between runs (0 disables), parallel calls, calls/second, chats per DB query
+    ADMIN_SYNC_INTERVAL: float = float(os.getenv("ADMIN_SYNC_INTERVAL", "21600"))
+    ADMIN_SYNC_CONCURRENCY: int = int(os.getenv("ADMIN_SYNC_CONCURRENCY", "8"))
+    ADMIN_SYNC_RATE: float = float(os.getenv("ADMIN_SYNC_RATE", "20"))
+    ADMIN_SYNC_CHUNK_SIZE: int = int(os.getenv("ADMIN_SYNC_CHUNK_SIZE", "200"))
+
+    # Anti-flood: this many messages from one user within the window (seconds) earn an automatic warn
+    # lasting ANTIFLOOD_WARN_DURATION ("30м", "1ч", ...; empty = no expiry). Off unless ANTIFLOOD_MESSAGES is set.
+    ANTIFLOOD_MESSAGES: int = int(os.getenv("ANTIFLOOD_MESSAGES", "0"))
+    ANTIFLOOD_WINDOW: float = float(os.getenv("ANTIFLOOD_WINDOW", "5"))
+    ANTIFLOOD_WARN_DURATION: str = os.getenv("ANTIFLOOD_WARN_DURATION", "30м")
+    # Users tracked per process; the least recently active ones are forgotten first
+    ANTIFLOOD_TRACKED_USERS: int = int(os.getenv("ANTIFLOOD_TRACKED_USERS", "100000"))
+
+    # Bulk commands (++пред, --пред, --админ): max targets per command; authors of this many recent
+    # messages are remembered per chat, for this many chats, to resolve "everyone since this message"
+    BULK_MAX_TARGETS: int = int(os.getenv("BULK_MAX_TARGETS", "200"))
+    RECENT_MESSAGES_PER_CHAT: int = int(os.getenv("RECENT_MESSAGES_PER_CHAT", "500"))
+    RECENT_CHATS: int = int(os.getenv("RECENT_CHATS", "2000"))
+
+    # Warn writes are group-committed: flush after this many ms or this many queued writes
+    WARN_FLUSH_INTERVAL_MS: float = float(os.getenv("WARN_FLUSH_INTERVAL_MS", "5"))
+    WARN_FLUSH_MAX_BATCH: int = int(os.getenv("WARN_FLUSH_MAX_BATCH", "100"))
+
+    # Prometheus /metrics endpoint; 0 disables metrics collection entirely
+    METRICS_HOST: str = os.getenv("METRICS_HOST", "127.0.0.1")
+    METRICS_PORT: int = int(os.getenv("METRICS_PORT", "0"))
+
+    # N+1 detector for development/tests: "off", "warn" or "raise" (see middlewares/querywatch.py)
+    QUERY_WATCH: str = os.getenv("QUERY_WATCH", "off").lower()
+    # Max repeats of one statement shape per handler, and max statements per handler (0 = no budget)
+    QUERY_WATCH_LIMIT: int = int(os.getenv("QUERY_WATCH_LIMIT", "3"))
+    QUERY_WATCH_BUDGET: int = int(os.getenv("QUERY_WATCH_BUDGET", "0"))
+
+    # How updates are received: "polling" or "webhook"
+    UPDATE_MODE: str = os.getenv("UPDATE_MODE", "polling").lower()
+    # Public URL registered with setWebhook; leave empty to manage the webhook yourself
+    WEBHOOK_URL: str = os.getenv("WEBHOOK_URL", "")
+    # Required in webhook mode: Telegram sends it in X-Telegram-Bot-Api-Secret-Token
+    WEBHOOK_SECRET: str = os.getenv("WEBHOOK_SECRET", "")
+    WEBHOOK_HOST: str = os.getenv("WEBHOOK_HOST", "127.0.0.1")
+    WEBHOOK_PORT: int = int(os.getenv("WEBHOOK_PORT", "8080"))
+    WEBHOOK_PATH: str = os.getenv("WEBHOOK_PATH", "/webhook")
+
+    # Worker processes handling updates, partitioned by chat (1 = handle in this process, see workers.py)
+    WORKERS: int = int(os.getenv("WORKERS", "1"))
+
+    # Max updates handled at the same time per process; one chat's updates always run one by one
+    # (see middlewares/scheduler.py). Defaults to the pool capacity, so handlers never wait for a connection
+    HANDLER_MAX_CONCURRENCY: int = int(os.getenv("HANDLER_MAX_CONCURRENCY", str(DB_POOL_SIZE + DB_MAX_OVERFLOW)))
+    # Load shedding: plain messages are dropped while one chat has this many updates queued,
+    # or all chats together this many (see middlewares/admission.py)
+    ADMISSION_CHAT_LIMIT: int = int(os.getenv("ADMISSION_CHAT_LIMIT", "50"))
+    ADMISSION_HIGH_WATER: int = int(os.getenv("ADMISSION_HIGH_WATER", "2000"))
+
     @property
     def CREATOR_IDS(self):
         s = self.CREATOR_IDS_RAW or ""
@@ -33,4 +117,7 @@ class Config:
 cfg = Config()
 
 if not cfg.BOT_TOKEN:
-    raise RuntimeError("BOT_TOKEN is not set. Please set BOT_TOKEN env var.")
\ No newline at end of file
+    raise RuntimeError("BOT_TOKEN is not set. Please set BOT_TOKEN env var.")
+if cfg.UPDATE_MODE == "webhook" and not cfg.WEBHOOK_SECRET:
+    # without it anyone who finds the endpoint can feed updates into the bot
+    raise RuntimeError("WEBHOOK_SECRET is not set. It is required with UPDATE_MODE=webhook.")
@@ -1,15 +1,128 @@
+import asyncio
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.util import await_only
 
 from config import cfg
 
-engine = create_async_engine(cfg.DATABASE_URL, echo=False, future=True)
+
+def engine_options(url) -> dict:
+    """
+    create_async_engine() kwargs for the backend in DATABASE_URL:
+    - SQLite file: sized queue pool and busy timeout (PRAGMAs are set on connect,
+      writers are serialized by SqliteWriteLock);
+      the pool class is explicit because aiosqlite defaulted to NullPool
+      before SQLAlchemy 2.0.38, which rejects the pool size arguments
+    - in-memory SQLite: driver defaults (single static connection)
+    - server databases: explicit pool size/overflow, pre-ping and recycle
+    """
+    url = make_url(url)
+    if url.get_backend_name() == "sqlite":
+        if url.database in (None, "", ":memory:"):
+            return {}
+        return {
+            "poolclass": AsyncAdaptedQueuePool,
+            "pool_size": cfg.DB_POOL_SIZE,
+            "max_overflow": cfg.DB_MAX_OVERFLOW,
+            "pool_timeout": cfg.DB_POOL_TIMEOUT,
+            "connect_args": {"timeout": cfg.SQLITE_BUSY_TIMEOUT_MS / 1000},
+        }
+    return {
+        "pool_size": cfg.DB_POOL_SIZE,
+        "max_overflow": cfg.DB_MAX_OVERFLOW,
+        "pool_timeout": cfg.DB_POOL_TIMEOUT,
+        "pool_pre_ping": True,
+        "pool_recycle": cfg.DB_POOL_RECYCLE,
+    }
+
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    # WAL lets readers run while a writer commits; NORMAL is durable enough in WAL mode
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={int(cfg.SQLITE_BUSY_TIMEOUT_MS)}")
+    cursor.execute(f"PRAGMA cache_size=-{int(cfg.SQLITE_CACHE_SIZE_KB)}")
+    cursor.execute(f"PRAGMA mmap_size={int(cfg.SQLITE_MMAP_SIZE)}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+
+class SqliteWriteLock:
+    """
+    Lets one pooled connection write at a time. SQLite has a single write
+    lock and its busy handler retries with growing sleeps, so with many
+    pooled writers a waiter can keep missing the lock for longer than
+    busy_timeout. Writers queue here in FIFO order instead; busy_timeout is
+    left to cover other processes. The lock is taken before a connection's
+    first write statement and released when its transaction ends.
+    """
+
+    _KEY = "sqlite_write_lock"
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self._lock = None
+        self._loop = None
+
+    def install(self, engine):
+        event.listen(engine.sync_engine, "before_cursor_execute", self._before_execute)
+        event.listen(engine.sync_engine, "commit", self._release)
+        event.listen(engine.sync_engine, "rollback", self._release)
+        # connections returned without an explicit commit/rollback
+        event.listen(engine.sync_engine.pool, "reset", self._release_record)
+        event.listen(engine.sync_engine.pool, "invalidate", self._release_record)
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if self._KEY in conn.info or statement.lstrip()[:6].upper() in ("SELECT", "PRAGMA"):
+            return
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._lock, self._loop = asyncio.Lock(), loop
+        lock = self._lock
+        try:
+            await_only(asyncio.wait_for(lock.acquire(), self.timeout))
+        except asyncio.TimeoutError:
+            # e.g. a second session writing while the caller's first one holds the lock:
+            # fall back to SQLite's own busy handling rather than wait forever
+            return
+        conn.info[self._KEY] = lock
+
+    def _release(self, conn):
+        self._release_info(conn.info)
+
+    def _release_record(self, dbapi_connection, connection_record, *args):
+        self._release_info(connection_record.info)
+
+    def _release_info(self, info):
+        lock = info.pop(self._KEY, None)
+        if lock is not None:
+            lock.release()
+
+
+def build_engine(url: str):
+    engine = create_async_engine(url, echo=False, future=True, **engine_options(url))
+    if engine.dialect.name == "sqlite":
+        event.listen(engine.sync_engine, "connect", _sqlite_pragmas)
+        if engine.url.database not in (None, "", ":memory:"):
+            SqliteWriteLock(cfg.SQLITE_BUSY_TIMEOUT_MS / 1000).install(engine)
+    return engine
+
+
+engine = build_engine(cfg.DATABASE_URL)
 AsyncSessionLocal = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
 Base = declarative_base()
 
 
 async def init_db():
-    # Create tables
+    from migrations import run_migrations
+
+    # Create tables, then bring existing databases up to the current schema
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
\ No newline at end of file
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(run_migrations)
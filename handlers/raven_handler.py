@@ -1,44 +1,90 @@
 
+import asyncio
 import re
+from functools import partial
 from aiogram import Router
 from aiogram.filters import Command
+from aiogram.methods import SendMessage
 from aiogram.types import Message
 from config import cfg
+from db import AsyncSessionLocal
+from models import Broadcast
+from services.broadcast import broadcasts
+from services.outbox import outbox
 
-router = Router()
+router = Router(name="raven")
+
+
+async def start_broadcast(message: Message, mode: str, arg: str):
+    """/send_raven_bot all <текст> — новая рассылка, /send_raven_bot resume <id> — продолжить прерванную."""
+    if mode == "all":
+        broadcast_id = await broadcasts.create(arg, message.from_user.id)
+    else:
+        if not arg.isdigit():
+            outbox.submit(message.reply("Укажите номер рассылки: /send_raven_bot resume [id]", parse_mode=cfg.PARSE_MODE))
+            return
+        broadcast_id = int(arg)
+        async with AsyncSessionLocal() as session:
+            b = await session.get(Broadcast, broadcast_id)
+        if not b:
+            outbox.submit(message.reply("Рассылка не найдена.", parse_mode=cfg.PARSE_MODE))
+            return
+        if b.finished_at:
+            outbox.submit(message.reply("Эта рассылка уже завершена.", parse_mode=cfg.PARSE_MODE))
+            return
+        if broadcasts.is_running(broadcast_id):
+            outbox.submit(message.reply("Эта рассылка уже выполняется.", parse_mode=cfg.PARSE_MODE))
+            return
+
+    status = outbox.submit(message.reply(f"📣 Рассылка #{broadcast_id} запускается…", parse_mode=cfg.PARSE_MODE))
+    broadcasts.start(message.bot, broadcast_id, status)
+
+
+def _report_sent(message: Message, sent: asyncio.Future):
+    if sent.cancelled():
+        return
+    error = sent.exception()
+    text = f"Ошибка при отправке сообщения: {error}" if error else "✅ Сообщение отправлено."
+    outbox.submit(message.reply(text, parse_mode=cfg.PARSE_MODE))
 
 @router.message(Command(commands=["send_raven_bot"]))
 async def cmd_send_raven_bot(message: Message):
 
     caller_id = message.from_user.id
     if caller_id not in cfg.CREATOR_IDS:
-        await message.reply("Команда доступна только создателям бота.", parse_mode=cfg.PARSE_MODE)
+        outbox.submit(message.reply("Команда доступна только создателям бота.", parse_mode=cfg.PARSE_MODE))
         return
 
     parts = message.text.strip().split(maxsplit=2)
     if len(parts) < 3:
-        await message.reply(
+        outbox.submit(message.reply(
             "Использование: /send_raven_bot [ссылка] [текст]\n"
-            "Пример: /send_raven_bot https://t.me/c/0000000000/0 Привет всем",
+            "Пример: /send_raven_bot https://t.me/c/0000000000/0 Привет всем\n"
+            "Рассылка во все чаты: /send_raven_bot all [текст]\n"
+            "Продолжить прерванную рассылку: /send_raven_bot resume [id]",
             parse_mode=cfg.PARSE_MODE,
-        )
+        ))
+        return
+
+    if parts[1].lower() in ("all", "resume"):
+        await start_broadcast(message, parts[1].lower(), parts[2].strip())
         return
 
     link = parts[1].strip()
     text = parts[2].strip()
     if not link:
-        await message.reply("Без указания ссылки нельзя отправлять сообщения!", parse_mode=cfg.PARSE_MODE)
+        outbox.submit(message.reply("Без указания ссылки нельзя отправлять сообщения!", parse_mode=cfg.PARSE_MODE))
         return
     if not text:
-        await message.reply("Текст сообщения не может быть пустым.", parse_mode=cfg.PARSE_MODE)
+        outbox.submit(message.reply("Текст сообщения не может быть пустым.", parse_mode=cfg.PARSE_MODE))
         return
 
     m = re.search(r"(?:https?:\/\/)?t\.me\/c\/(\d+)\/\d+", link)
     if not m:
-        await message.reply(
+        outbox.submit(message.reply(
             "Неверная ссылка. Поддерживается только формат: https://t.me/c/<chat_short_id>/<msg_id>",
             parse_mode=cfg.PARSE_MODE,
-        )
+        ))
         return
 
     short_id = m.group(1)
@@ -46,12 +92,9 @@ async def cmd_send_raven_bot(message: Message):
     try:
         chat_id = int(f"-100{short_id}")
     except Exception:
-        await message.reply("Не удалось преобразовать id чата из ссылки.", parse_mode=cfg.PARSE_MODE)
+        outbox.submit(message.reply("Не удалось преобразовать id чата из ссылки.", parse_mode=cfg.PARSE_MODE))
         return
 
-    try:
-        await message.bot.send_message(chat_id, text, parse_mode=cfg.PARSE_MODE)
-        await message.reply("✅ Сообщение отправлено.", parse_mode=cfg.PARSE_MODE)
-    except Exception as e:
-
-        await message.reply(f"Ошибка при отправке сообщения: {e}", parse_mode=cfg.PARSE_MODE)
\ No newline at end of file
+    # the target chat's send queue can be long; report back when it is through instead of waiting here
+    sent = outbox.submit(SendMessage(chat_id=chat_id, text=text, parse_mode=cfg.PARSE_MODE).as_(message.bot))
+    sent.add_done_callback(partial(_report_sent, message))
\ No newline at end of file
@@ -1,13 +1,20 @@
-import re
 from datetime import datetime
 from aiogram import Router
 from aiogram.types import Message
 from sqlalchemy import select, delete
-from db import AsyncSessionLocal
-from models import RoleAssignment, Chat, ROLE_MAP, Nick
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import RoleAssignment, Chat, ROLE_MAP
 from config import cfg
+from services.outbox import outbox
+from commands import Cmd, ParsedCommand
+from services.names import format_user_link, resolve_display_names, user_link, user_links
+from services.recent import bulk_targets
+from services.adminlist import admin_lists
+from services.chats import chat_registry
+from services.roles import role_index
+from upserts import upsert_role
 
-router = Router()
+router = Router(name="roles")
 
 # Helpers
 async def get_role_assignments(session, chat_id):
@@ -19,28 +26,6 @@ def role_name(role_id: int) -> str:
     return ROLE_MAP.get(role_id, ("Неизвестно", ""))[0]
 
 
-async def format_user_link(chat_id: int, user_id: int, bot, session):
-    """
-    Return HTML link with displayed name:
-    - prefer stored Nick in DB
-    - else use Telegram full name from get_chat_member
-    """
-    # check nick in DB
-    q = await session.execute(select(Nick).where(Nick.chat_id == chat_id, Nick.user_id == user_id))
-    nick = q.scalars().first()
-    if nick:
-        display = nick.nick
-    else:
-        try:
-            member = await bot.get_chat_member(chat_id, user_id)
-            u = member.user
-            display = u.full_name
-        except Exception:
-            display = str(user_id)
-    # Escape is not done here; we rely on simple names. For safety you can html-escape if needed.
-    return f'<a href="tg://user?id={user_id}">{display}</a>'
-
-
 async def parse_target_user_from_message(message: Message):
     """
     Returns (user_id, display_token) or (None, None)
@@ -61,44 +46,53 @@ async def parse_target_user_from_message(message: Message):
     return None, None
 
 
-@router.message(lambda message: message.text and re.match(r"^(админы|\?админ)$", message.text.strip(), re.IGNORECASE))
-async def cmd_list_admins(message: Message):
-    async with AsyncSessionLocal() as session:
-        assigns = await get_role_assignments(session, message.chat.id)
-        # build text with links
-        roles_map = {}
-        for a in assigns:
-            roles_map.setdefault(a.role_id, []).append(a)
-
-        text_lines = ["🍊 Список администраторов\n"]
-        for rid in sorted(ROLE_MAP.keys(), reverse=True):
-            title = ROLE_MAP[rid][0]
-            members = roles_map.get(rid, [])
-            text_lines.append(f"[{rid}] {title}")
-            if members:
-                for m in members:
-                    # build link using stored nick or telegram name
-                    link = await format_user_link(message.chat.id, m.user_id, message.bot, session)
-                    text_lines.append(f"{link}")
-            else:
-                text_lines.append("(пусто)")
-            text_lines.append("")  # spacer
-
-    await message.answer("\n".join(text_lines), parse_mode=cfg.PARSE_MODE)
+async def render_admin_list(chat_id: int, bot, session) -> str:
+    assigns = await get_role_assignments(session, chat_id)
+    # build text with links
+    roles_map = {}
+    for a in assigns:
+        roles_map.setdefault(a.role_id, []).append(a)
+    names = await resolve_display_names({(chat_id, a.user_id) for a in assigns}, bot, session)
+
+    text_lines = ["🍊 Список администраторов\n"]
+    for rid in sorted(ROLE_MAP.keys(), reverse=True):
+        title = ROLE_MAP[rid][0]
+        members = roles_map.get(rid, [])
+        text_lines.append(f"[{rid}] {title}")
+        if members:
+            for m in members:
+                # build link using stored nick or telegram name
+                link = user_link(m.user_id, names[(chat_id, m.user_id)])
+                text_lines.append(f"{link}")
+        else:
+            text_lines.append("(пусто)")
+        text_lines.append("")  # spacer
+
+    return "\n".join(text_lines)
+
+
+@router.message(Cmd("админы", "?админ", args=False))
+async def cmd_list_admins(message: Message, session: AsyncSession):
+    chat_id = message.chat.id
+    # served from memory until a role or nick in this chat changes
+    text = admin_lists.get(chat_id)
+    if text is None:
+        version = admin_lists.version(chat_id)
+        text = await render_admin_list(chat_id, message.bot, session)
+        admin_lists.put(chat_id, version, text)
+    outbox.submit(message.answer(text, parse_mode=cfg.PARSE_MODE))
 
 
 # Assign role command: +админ / +модер / выдать
-@router.message(lambda message: message.text and re.match(r"^(\+админ|\+модер|выдать)\b", message.text.strip(), re.IGNORECASE))
-async def cmd_assign(message: Message):
+@router.message(Cmd("+админ", "+модер", "выдать"))
+async def cmd_assign(message: Message, session: AsyncSession):
     caller_id = message.from_user.id
     chat_id = message.chat.id
 
-    async with AsyncSessionLocal() as session:
-        q = await session.execute(select(RoleAssignment).where(RoleAssignment.chat_id == chat_id, RoleAssignment.user_id == caller_id))
-        caller_assign = q.scalars().first()
+    caller_role = await role_index.role_of(chat_id, caller_id)
     # check if caller is owner (role_id==5)
-    if not caller_assign or caller_assign.role_id != 5:
-        await message.reply("Только Владелец может выдавать админов.", parse_mode=cfg.PARSE_MODE)
+    if caller_role != 5:
+        outbox.submit(message.reply("Только Владелец может выдавать админов.", parse_mode=cfg.PARSE_MODE))
         return
 
     target_user_id, target_display = await parse_target_user_from_message(message)
@@ -124,111 +118,139 @@ async def cmd_assign(message: Message):
                 reason = rest
 
     if not target_user_id:
-        await message.reply("Не удалось определить пользователя. Ответьте на сообщение пользователя или укажите id (не @username).", parse_mode=cfg.PARSE_MODE)
+        outbox.submit(message.reply("Не удалось определить пользователя. Ответьте на сообщение пользователя или укажите id (не @username).", parse_mode=cfg.PARSE_MODE))
         return
 
-    async with AsyncSessionLocal() as session:
-        # upsert assignment
-        q = await session.execute(select(RoleAssignment).where(RoleAssignment.chat_id == chat_id, RoleAssignment.user_id == target_user_id))
-        existing = q.scalars().first()
-        if existing:
-            existing.role_id = role_id
-            existing.assigned_by = caller_id
-            existing.reason = reason
-            existing.assigned_at = datetime.utcnow()
-            session.add(existing)
-        else:
-            ra = RoleAssignment(chat_id=chat_id, user_id=target_user_id, role_id=role_id, assigned_by=caller_id, reason=reason)
-            session.add(ra)
-        await session.commit()
-        # prepare link using nick or Telegram name
-        link = await format_user_link(chat_id, target_user_id, message.bot, session)
+    await chat_registry.ensure(chat_id)
+    # prepare link using nick or Telegram name
+    link = await format_user_link(chat_id, target_user_id, message.bot, session)
+    await upsert_role(
+        session, chat_id, target_user_id, role_id,
+        assigned_by=caller_id, reason=reason, assigned_at=datetime.utcnow(),
+    )
+    await session.commit()
+    role_index.set(chat_id, target_user_id, role_id)
+    admin_lists.bump(chat_id)
 
-    await message.reply(f"➕ {link} назначен на роль: {role_name(role_id)} [{role_id}]\nС большой силой приходит большая ответственность.", parse_mode=cfg.PARSE_MODE)
+    outbox.submit(message.reply(f"➕ {link} назначен на роль: {role_name(role_id)} [{role_id}]\nС большой силой приходит большая ответственность.", parse_mode=cfg.PARSE_MODE))
 
 
 # Remove admin: -админ / снять
-@router.message(lambda message: message.text and re.match(r"^(-админ|снять)\b", message.text.strip(), re.IGNORECASE))
-async def cmd_remove_admin(message: Message):
+@router.message(Cmd("-админ", "снять"))
+async def cmd_remove_admin(message: Message, session: AsyncSession):
     caller_id = message.from_user.id
     chat_id = message.chat.id
 
     # Only owner can remove, enforced below
-    async with AsyncSessionLocal() as session:
-        q = await session.execute(select(RoleAssignment).where(RoleAssignment.chat_id == chat_id, RoleAssignment.user_id == caller_id))
-        caller_assign = q.scalars().first()
-    if not caller_assign or caller_assign.role_id != 5:
-        await message.reply("Только Владелец может снимать админов.", parse_mode=cfg.PARSE_MODE)
+    caller_role = await role_index.role_of(chat_id, caller_id)
+    if caller_role != 5:
+        outbox.submit(message.reply("Только Владелец может снимать админов.", parse_mode=cfg.PARSE_MODE))
         return
 
     target_user_id, target_display = await parse_target_user_from_message(message)
     if not target_user_id:
-        await message.reply("Не удалось определить пользователя. Ответьте на сообщение пользователя или укажите id.", parse_mode=cfg.PARSE_MODE)
+        outbox.submit(message.reply("Не удалось определить пользователя. Ответьте на сообщение пользователя или укажите id.", parse_mode=cfg.PARSE_MODE))
         return
 
     # Prevent removing yourself (owner cannot remove self)
     if target_user_id == caller_id:
-        await message.reply("Нельзя снять роль у самого себя.", parse_mode=cfg.PARSE_MODE)
+        outbox.submit(message.reply("Нельзя снять роль у самого себя.", parse_mode=cfg.PARSE_MODE))
         return
 
-    async with AsyncSessionLocal() as session:
-        q = await session.execute(select(RoleAssignment).where(RoleAssignment.chat_id == chat_id, RoleAssignment.user_id == target_user_id))
-        existing = q.scalars().first()
-        if not existing:
-            await message.reply("У пользователя нет роли в этой группе.", parse_mode=cfg.PARSE_MODE)
-            return
-        roleid = existing.role_id
-        await session.execute(delete(RoleAssignment).where(RoleAssignment.chat_id == chat_id, RoleAssignment.user_id == target_user_id))
-        await session.commit()
-        link = await format_user_link(chat_id, target_user_id, message.bot, session)
+    q = await session.execute(select(RoleAssignment).where(RoleAssignment.chat_id == chat_id, RoleAssignment.user_id == target_user_id))
+    existing = q.scalars().first()
+    if not existing:
+        outbox.submit(message.reply("У пользователя нет роли в этой группе.", parse_mode=cfg.PARSE_MODE))
+        return
+    roleid = existing.role_id
+    link = await format_user_link(chat_id, target_user_id, message.bot, session)
+    await session.execute(delete(RoleAssignment).where(RoleAssignment.chat_id == chat_id, RoleAssignment.user_id == target_user_id))
+    await session.commit()
+    role_index.discard(chat_id, target_user_id)
+    admin_lists.bump(chat_id)
+
+    outbox.submit(message.reply(f"➖ {link} снят с роли: {role_name(roleid)} [{roleid}]\nСпасибо за вклад в управление чатом.", parse_mode=cfg.PARSE_MODE))
 
-    await message.reply(f"➖ {link} снят с роли: {role_name(roleid)} [{roleid}]\nСпасибо за вклад в управление чатом.", parse_mode=cfg.PARSE_MODE)
+
+# Bulk remove: --админ <id> <id> ... or a reply to the first of a range of messages
+@router.message(Cmd("--админ"))
+async def cmd_bulk_remove_admin(message: Message, cmd: ParsedCommand, session: AsyncSession):
+    caller_id = message.from_user.id
+    chat_id = message.chat.id
+
+    caller_role = await role_index.role_of(chat_id, caller_id)
+    if caller_role != 5:
+        outbox.submit(message.reply("Только Владелец может снимать админов.", parse_mode=cfg.PARSE_MODE))
+        return
+
+    # the owner is never a target of their own command
+    targets, _, _ = bulk_targets(message, cmd.args, cfg.BULK_MAX_TARGETS)
+    if not targets:
+        outbox.submit(message.reply("Укажите id пользователей через пробел или ответьте на первое сообщение — "
+                                    "тогда роли снимутся со всех, кто писал после него.", parse_mode=cfg.PARSE_MODE))
+        return
+
+    q = await session.execute(select(RoleAssignment.user_id).where(
+        RoleAssignment.chat_id == chat_id, RoleAssignment.user_id.in_(targets)))
+    holders = set(q.scalars().all())
+    if not holders:
+        outbox.submit(message.reply("Ни у кого из них нет роли в этой группе.", parse_mode=cfg.PARSE_MODE))
+        return
+    removed = [user_id for user_id in targets if user_id in holders]
+    names = await resolve_display_names({(chat_id, user_id) for user_id in removed}, message.bot, session)
+    await session.execute(delete(RoleAssignment).where(
+        RoleAssignment.chat_id == chat_id, RoleAssignment.user_id.in_(removed)))
+    await session.commit()
+    for user_id in removed:
+        role_index.discard(chat_id, user_id)
+    admin_lists.bump(chat_id)
+
+    outbox.submit(message.reply(f"➖ Сняты с ролей ({len(removed)}): {user_links(chat_id, removed, names)}",
+                                parse_mode=cfg.PARSE_MODE))
 
 
 # Promote / demote (only one step)
-@router.message(lambda message: message.text and re.match(r"^(повысить|повышение|понизить|понижение)\b", message.text.strip(), re.IGNORECASE))
-async def cmd_promote_demote(message: Message):
+@router.message(Cmd("повысить", "повышение", "понизить", "понижение"))
+async def cmd_promote_demote(message: Message, cmd: ParsedCommand, session: AsyncSession):
     caller_id = message.from_user.id
     chat_id = message.chat.id
-    text = message.text.strip().split()[0].lower()
-    is_promote = text.startswith("повыш")
-
-    async with AsyncSessionLocal() as session:
-        q = await session.execute(select(RoleAssignment).where(RoleAssignment.chat_id == chat_id, RoleAssignment.user_id == caller_id))
-        caller_assign = q.scalars().first()
-    if not caller_assign or caller_assign.role_id != 5:
-        await message.reply("Только Владелец может повышать/понижать.", parse_mode=cfg.PARSE_MODE)
+    is_promote = cmd.word.startswith("повыш")
+
+    caller_role = await role_index.role_of(chat_id, caller_id)
+    if caller_role != 5:
+        outbox.submit(message.reply("Только Владелец может повышать/понижать.", parse_mode=cfg.PARSE_MODE))
         return
 
     target_user_id, target_display = await parse_target_user_from_message(message)
     if not target_user_id:
-        await message.reply("Не удалось определить пользователя. Ответьте на сообщение пользователя или укажите id.", parse_mode=cfg.PARSE_MODE)
+        outbox.submit(message.reply("Не удалось определить пользователя. Ответьте на сообщение пользователя или укажите id.", parse_mode=cfg.PARSE_MODE))
         return
 
-    async with AsyncSessionLocal() as session:
-        q = await session.execute(select(RoleAssignment).where(RoleAssignment.chat_id == chat_id, RoleAssignment.user_id == target_user_id))
-        existing = q.scalars().first()
-        if not existing:
-            await message.reply("У пользователя нет назначенной роли.", parse_mode=cfg.PARSE_MODE)
+    q = await session.execute(select(RoleAssignment).where(RoleAssignment.chat_id == chat_id, RoleAssignment.user_id == target_user_id))
+    existing = q.scalars().first()
+    if not existing:
+        outbox.submit(message.reply("У пользователя нет назначенной роли.", parse_mode=cfg.PARSE_MODE))
+        return
+    old = existing.role_id
+    if is_promote:
+        new = min(5, old + 1)
+        if new == old:
+            outbox.submit(message.reply("Нельзя повысить выше существующей роли.", parse_mode=cfg.PARSE_MODE))
             return
-        old = existing.role_id
-        if is_promote:
-            new = min(5, old + 1)
-            if new == old:
-                await message.reply("Нельзя повысить выше существующей роли.", parse_mode=cfg.PARSE_MODE)
-                return
-            existing.role_id = new
-            session.add(existing)
-            await session.commit()
-            link = await format_user_link(chat_id, target_user_id, message.bot, session)
-            await message.reply(f"⬆️ {link} повышен до: {role_name(new)} [{new}]\nДоверие растёт — ответственность тоже.", parse_mode=cfg.PARSE_MODE)
-        else:
-            new = max(1, old - 1)
-            if new == old:
-                await message.reply("Нельзя понизить ниже минимальной роли.", parse_mode=cfg.PARSE_MODE)
-                return
-            existing.role_id = new
-            session.add(existing)
-            await session.commit()
-            link = await format_user_link(chat_id, target_user_id, message.bot, session)
-            await message.reply(f"⬇️ {link} понижен до: {role_name(new)} [{new}]\nРоль изменена, но вклад всё ещё ценится.", parse_mode=cfg.PARSE_MODE)
\ No newline at end of file
+        link = await format_user_link(chat_id, target_user_id, message.bot, session)
+        existing.role_id = new
+        await session.commit()
+        role_index.set(chat_id, target_user_id, new)
+        admin_lists.bump(chat_id)
+        outbox.submit(message.reply(f"⬆️ {link} повышен до: {role_name(new)} [{new}]\nДоверие растёт — ответственность тоже.", parse_mode=cfg.PARSE_MODE))
+    else:
+        new = max(1, old - 1)
+        if new == old:
+            outbox.submit(message.reply("Нельзя понизить ниже минимальной роли.", parse_mode=cfg.PARSE_MODE))
+            return
+        link = await format_user_link(chat_id, target_user_id, message.bot, session)
+        existing.role_id = new
+        await session.commit()
+        role_index.set(chat_id, target_user_id, new)
+        admin_lists.bump(chat_id)
+        outbox.submit(message.reply(f"⬇️ {link} понижен до: {role_name(new)} [{new}]\nРоль изменена, но вклад всё ещё ценится.", parse_mode=cfg.PARSE_MODE))
\ No newline at end of file
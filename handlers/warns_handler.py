@@ -1,35 +1,26 @@
-import re
 from datetime import datetime
 from aiogram import Router
 from aiogram.types import Message, CallbackQuery
-from sqlalchemy import select, update, desc
-from db import AsyncSessionLocal
-from models import Warn, RoleAssignment, Nick
-from utils import parse_duration, format_timedelta_remaining
+from sqlalchemy import select, func, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Warn
+from utils import parse_duration, format_timedelta_remaining, encode_cursor, decode_cursor
 from keyboards import page_kb
 from config import cfg
+from services.outbox import outbox
+from commands import Cmd, ParsedCommand
+from services.names import format_user_link, resolve_display_names, user_link, user_links
+from services.recent import bulk_targets
+from services.roles import role_index
+from services.warns import deactivate_latest_warns, issue_warn, issue_warns
+from services.writebuffer import warn_writes
 
-router = Router()
-
-
-async def format_user_link(chat_id: int, user_id: int, bot, session):
-    q = await session.execute(select(Nick).where(Nick.chat_id == chat_id, Nick.user_id == user_id))
-    nick = q.scalars().first()
-    if nick:
-        display = nick.nick
-    else:
-        try:
-            member = await bot.get_chat_member(chat_id, user_id)
-            display = member.user.full_name
-        except Exception:
-            display = str(user_id)
-    return f'<a href="tg://user?id={user_id}">{display}</a>'
+router = Router(name="warns")
 
 
 # --- ХЕНДЛЕР ВЫДАЧИ ПРЕДУПРЕЖДЕНИЯ ---
-@router.message(
-    lambda message: message.text and re.match(r"^(?:\+?пред|\+?варн|\+пред|\+варн)\b", message.text.strip(), re.IGNORECASE))
-async def cmd_warn(message: Message):
+@router.message(Cmd("пред", "+пред", "варн", "+варн"))
+async def cmd_warn(message: Message, session: AsyncSession):
     parts = message.text.strip().split(maxsplit=2)
 
     # Если команда вызвана без аргументов и без реплая — показываем справку
@@ -43,7 +34,7 @@ async def cmd_warn(message: Message):
             "• <code>+пред 1ч Оскорбление</code>\n"
             "• <code>+пред 1д</code> (без причины)"
         )
-        await message.reply(help_text, parse_mode="HTML")
+        outbox.submit(message.reply(help_text, parse_mode="HTML"))
         return
 
 
@@ -53,19 +44,15 @@ async def cmd_warn(message: Message):
             "Чтобы выдать предупреждение — используйте <code>+пред</code> или <code>+варн</code>.\n"
             "Если хотите посмотреть справку — напишите просто <code>пред</code> или <code>варн</code> без плюса."
         )
-        await message.reply(help_text, parse_mode="HTML")
+        outbox.submit(message.reply(help_text, parse_mode="HTML"))
         return
 
     issuer = message.from_user.id
     chat_id = message.chat.id
 
-
-    async with AsyncSessionLocal() as session:
-        q = await session.execute(
-            select(RoleAssignment).where(RoleAssignment.chat_id == chat_id, RoleAssignment.user_id == issuer))
-        caller_assign = q.scalars().first()
-    if not caller_assign or caller_assign.role_id < 1:
-        await message.reply("<b>❌ Вы не имеете права выдавать предупреждения.</b>", parse_mode="HTML")
+    caller_role = await role_index.role_of(chat_id, issuer)
+    if not caller_role or caller_role < 1:
+        outbox.submit(message.reply("<b>❌ Вы не имеете права выдавать предупреждения.</b>", parse_mode="HTML"))
         return
 
     # target detection
@@ -74,15 +61,15 @@ async def cmd_warn(message: Message):
     else:
         token = parts[1]
         if token.startswith("@"):
-            await message.reply(
+            outbox.submit(message.reply(
                 "<b>Пожалуйста, используйте reply на сообщение пользователя или укажите его id (без @username).</b>",
-                parse_mode="HTML")
+                parse_mode="HTML"))
             return
         if token.isdigit():
             target_id = int(token)
         else:
-            await message.reply("<b>Не удалось определить пользователя. Укажите ID или ответьте на сообщение.</b>",
-                                parse_mode="HTML")
+            outbox.submit(message.reply("<b>Не удалось определить пользователя. Укажите ID или ответьте на сообщение.</b>",
+                                parse_mode="HTML"))
             return
 
     # parse time and reason
@@ -126,22 +113,19 @@ async def cmd_warn(message: Message):
     if time_td:
         until_dt = datetime.now() + time_td
 
-    async with AsyncSessionLocal() as session:
-        w = Warn(chat_id=chat_id, user_id=target_id, issued_by=issuer, reason=reason, until=until_dt, active=True)
-        session.add(w)
-        await session.commit()
-        await session.refresh(w)
-        link = await format_user_link(chat_id, target_id, message.bot, session)
+    # group-committed with other warns; resolves once the row is durable
+    await issue_warn(chat_id, target_id, issuer, reason, until_dt)
+    link = await format_user_link(chat_id, target_id, message.bot, session)
 
     until_text = until_dt.strftime("%H:%M:%S %d.%m.%Y") if until_dt else "без срока"
-    await message.reply(f"⚠️ {link} получил предупреждение до <b>{until_text}</b> за: <b>{reason or 'Причина не указана'}</b>.",
-                        parse_mode="HTML")
+    outbox.submit(message.reply(f"⚠️ {link} получил предупреждение до <b>{until_text}</b> за: <b>{reason or 'Причина не указана'}</b>.",
+                        parse_mode="HTML"))
 
 
 # --- ХЕНДЛЕР СНЯТИЯ ПРЕДУПРЕЖДЕНИЯ ---
-@router.message(
-    lambda message: message.text and re.match(r"^(-варн|-пред|снять)\b", message.text.strip(), re.IGNORECASE))
-async def cmd_unwarn(message: Message):
+# "снять" belongs to cmd_remove_admin (roles router always matched it first)
+@router.message(Cmd("-варн", "-пред"))
+async def cmd_unwarn(message: Message, session: AsyncSession):
     parts = message.text.strip().split(maxsplit=1)
     chat_id = message.chat.id
     target_id = None
@@ -155,179 +139,229 @@ async def cmd_unwarn(message: Message):
                 target_id = int(token)
 
     if not target_id:
-        await message.reply("<b>Ответьте на сообщение пользователя или укажите его id.</b>", parse_mode="HTML")
+        outbox.submit(message.reply("<b>Ответьте на сообщение пользователя или укажите его id.</b>", parse_mode="HTML"))
         return
 
     issuer = message.from_user.id
 
-    async with AsyncSessionLocal() as session:
-        # Проверка прав
-        q = await session.execute(
-            select(RoleAssignment).where(RoleAssignment.chat_id == chat_id, RoleAssignment.user_id == issuer))
-        caller_assign = q.scalars().first()
-        if not caller_assign or caller_assign.role_id < 1:
-            await message.reply("<b>❌ Вы не имеете права снимать предупреждения.</b>", parse_mode="HTML")
-            return
+    # Проверка прав
+    caller_role = await role_index.role_of(chat_id, issuer)
+    if not caller_role or caller_role < 1:
+        outbox.submit(message.reply("<b>❌ Вы не имеете права снимать предупреждения.</b>", parse_mode="HTML"))
+        return
 
-        # Ищем только последнее активное предупреждение (по created_at)
-        stmt = select(Warn).where(
-            Warn.chat_id == chat_id,
-            Warn.user_id == target_id,
-            Warn.active == True
-        ).order_by(desc(Warn.created_at)).limit(1)
+    # Снимаем только последнее активное предупреждение (по created_at)
+    removed = await warn_writes.deactivate_latest(chat_id, target_id)
 
-        result = await session.execute(stmt)
-        warn_to_remove = result.scalars().first()
+    link = await format_user_link(chat_id, target_id, message.bot, session)
 
-        link = await format_user_link(chat_id, target_id, message.bot, session)
+    if removed:
+        outbox.submit(message.reply(f"✅ С {link} было снято 1 предупреждение.", parse_mode="HTML"))
+    else:
+        outbox.submit(message.reply(f"ℹ️ У пользователя {link} нет активных предупреждений.", parse_mode="HTML"))
 
-        if warn_to_remove:
-            warn_to_remove.active = False
-            await session.commit()
-            await message.reply(f"✅ С {link} было снято 1 предупреждение.", parse_mode="HTML")
-        else:
-            await message.reply(f"ℹ️ У пользователя {link} нет активных предупреждений.", parse_mode="HTML")
 
+# --- МАССОВЫЕ ПРЕДУПРЕЖДЕНИЯ ---
+BULK_HELP = (
+    "Укажите id пользователей через пробел или ответьте на первое сообщение — "
+    "тогда команда применится ко всем, кто писал после него."
+)
 
-# --- ХЕНДЛЕР СПИСКА ПРЕДУПРЕЖДЕНИЙ ---
-@router.message(
-    lambda message: message.text and re.match(r"^(\?пред|\?варн)(\s+(\d+))?$", message.text.strip(), re.IGNORECASE))
-async def cmd_list_warns(message: Message):
+
+@router.message(Cmd("++пред", "++варн"))
+async def cmd_bulk_warn(message: Message, cmd: ParsedCommand, session: AsyncSession):
+    # ++пред <id> <id> ... [время] [причина]  или ответом: ++пред [время] [причина]
     chat_id = message.chat.id
-    text = message.text.strip()
-    parts = text.split()
-    page = 1
-    # Если указан номер страницы в аргументе — используем его
-    if len(parts) >= 2 and parts[1].isdigit():
-        page = max(1, int(parts[1]))
-    per_page = 10
+    issuer = message.from_user.id
 
-    # Если команда вызвана как reply — показываем предупреждения конкретного игрока
-    target_user_id = None
-    target_display = None
-    if message.reply_to_message and message.reply_to_message.from_user:
-        target_user_id = message.reply_to_message.from_user.id
+    caller_role = await role_index.role_of(chat_id, issuer)
+    if not caller_role or caller_role < 1:
+        outbox.submit(message.reply("<b>❌ Вы не имеете права выдавать предупреждения.</b>", parse_mode="HTML"))
+        return
 
-    async with AsyncSessionLocal() as session:
-        if target_user_id:
-            q = await session.execute(
-                select(Warn).where(Warn.chat_id == chat_id, Warn.active == True, Warn.user_id == target_user_id)
-                .order_by(Warn.created_at.desc()))
-            warns = q.scalars().all()
-            # получим отображаемое имя для заголовка
-            target_display = await format_user_link(chat_id, target_user_id, message.bot, session)
-        else:
-            q = await session.execute(
-                select(Warn).where(Warn.chat_id == chat_id, Warn.active == True).order_by(Warn.created_at.desc()))
-            warns = q.scalars().all()
+    targets, rest, from_range = bulk_targets(message, cmd.args, cfg.BULK_MAX_TARGETS)
+    if from_range:
+        # moderators answering the raid are not part of it
+        roles = await role_index.roles(chat_id)
+        targets = [user_id for user_id in targets if user_id not in roles]
+    if not targets:
+        outbox.submit(message.reply(f"<b>ℹ️ {BULK_HELP}</b>\n<code>++пред</code> [время] [причина]", parse_mode="HTML"))
+        return
 
-    total = len(warns)
-    if total == 0:
-        if target_user_id:
-            await message.reply(f"ℹ️ {target_display} не имеет активных предупреждений.", parse_mode="HTML")
-        else:
-            await message.reply("ℹ️ В чате нет активных предупреждений.", parse_mode="HTML")
+    time_td = parse_duration(rest[0]) if rest else None
+    if time_td:
+        rest = rest[1:]
+    reason = " ".join(rest) or None
+    until_dt = datetime.now() + time_td if time_td else None
+
+    await issue_warns(session, chat_id, targets, issuer, reason, until_dt)
+    names = await resolve_display_names({(chat_id, user_id) for user_id in targets}, message.bot, session)
+
+    until_text = until_dt.strftime("%H:%M:%S %d.%m.%Y") if until_dt else "без срока"
+    outbox.submit(message.reply(
+        f"⚠️ Предупреждение до <b>{until_text}</b> за: <b>{reason or 'Причина не указана'}</b> "
+        f"получили {len(targets)}: {user_links(chat_id, targets, names)}", parse_mode="HTML"))
+
+
+@router.message(Cmd("--пред", "--варн"))
+async def cmd_bulk_unwarn(message: Message, cmd: ParsedCommand, session: AsyncSession):
+    chat_id = message.chat.id
+    issuer = message.from_user.id
+
+    caller_role = await role_index.role_of(chat_id, issuer)
+    if not caller_role or caller_role < 1:
+        outbox.submit(message.reply("<b>❌ Вы не имеете права снимать предупреждения.</b>", parse_mode="HTML"))
+        return
+
+    targets, _, _ = bulk_targets(message, cmd.args, cfg.BULK_MAX_TARGETS)
+    if not targets:
+        outbox.submit(message.reply(f"<b>ℹ️ {BULK_HELP}</b>\n<code>--пред</code>", parse_mode="HTML"))
+        return
+
+    # the newest active warn of every target, like -пред
+    removed = await deactivate_latest_warns(session, chat_id, targets)
+    if not removed:
+        outbox.submit(message.reply("ℹ️ Ни у кого из них нет активных предупреждений.", parse_mode="HTML"))
         return
+    cleared = [user_id for user_id in targets if user_id in removed]
+    names = await resolve_display_names({(chat_id, user_id) for user_id in cleared}, message.bot, session)
 
-    total_pages = max(1, (total + per_page - 1) // per_page)
-    if page > total_pages:
-        page = total_pages
+    text = f"✅ Снято по 1 предупреждению с {len(cleared)}: {user_links(chat_id, cleared, names)}"
+    if len(cleared) < len(targets):
+        text += f"\nℹ️ Без активных предупреждений: {len(targets) - len(cleared)}"
+    outbox.submit(message.reply(text, parse_mode="HTML"))
 
-    start = (page - 1) * per_page
-    page_warns = warns[start:start + per_page]
+
+# --- ХЕНДЛЕР СПИСКА ПРЕДУПРЕЖДЕНИЙ ---
+WARNS_PER_PAGE = 10
+
+
+async def render_warns_page(chat_id: int, bot, session, target_user_id=None, page: int = 1, cursor=None,
+                            direction: str = "n"):
+    """
+    Build one page of the active warns list.
+    Pagination happens in SQL: COUNT for the total and keyset on (created_at, id)
+    when a cursor from the keyboard is given, so any page costs the same as the first.
+    Returns (text, keyboard, total); text is None when the requested page is empty,
+    and then no names are resolved.
+    """
+    conds = [Warn.chat_id == chat_id, Warn.active == True]
+    if target_user_id:
+        conds.append(Warn.user_id == target_user_id)
+
+    total = (await session.execute(select(func.count()).select_from(Warn).where(*conds))).scalar_one()
+    if not total:
+        return None, None, total
+    total_pages = max(1, (total + WARNS_PER_PAGE - 1) // WARNS_PER_PAGE)
+    page = min(max(1, page), total_pages)
+
+    stmt = select(Warn).where(*conds)
+    key = tuple_(Warn.created_at, Warn.id)
+    if cursor is None:
+        # Прямой переход на страницу (?пред N) — единственный случай с OFFSET
+        stmt = stmt.order_by(Warn.created_at.desc(), Warn.id.desc()).offset((page - 1) * WARNS_PER_PAGE)
+    elif direction == "p":
+        stmt = stmt.where(key > tuple_(*cursor)).order_by(Warn.created_at.asc(), Warn.id.asc())
+    else:
+        stmt = stmt.where(key < tuple_(*cursor)).order_by(Warn.created_at.desc(), Warn.id.desc())
+    q = await session.execute(stmt.limit(WARNS_PER_PAGE))
+    page_warns = q.scalars().all()
+    if direction == "p" and cursor is not None:
+        page_warns.reverse()
+    if not page_warns:
+        return None, None, total
+
+    pairs = {(chat_id, w.user_id) for w in page_warns}
+    pairs.update((chat_id, w.issued_by) for w in page_warns if w.issued_by)
+    if target_user_id:
+        pairs.add((chat_id, target_user_id))
+    names = await resolve_display_names(pairs, bot, session)
 
     text_lines = []
     header = "⚠️ Активные предупреждения"
     if target_user_id:
-        header = f"⚠️ Активные предупреждения для {target_display}"
+        header = f"⚠️ Активные предупреждения для {user_link(target_user_id, names[(chat_id, target_user_id)])}"
     text_lines.append(f"<b>{header}</b>")
     text_lines.append(f"┌─ <b>Всего активных предупреждений:</b> {total}")
     text_lines.append("├─ <b>Список предупреждений:</b>")
 
-    async with AsyncSessionLocal() as session:
-        for idx, w in enumerate(page_warns, start=start + 1):
-            rem = format_timedelta_remaining(w.until) if w.until else "без срока"
-            link = await format_user_link(chat_id, w.user_id, message.bot, session)
-            # Показываем кто выдал предупреждение и причину
-            issuer_link = await format_user_link(chat_id, w.issued_by, message.bot, session) if w.issued_by else "Система"
-            created = w.created_at.strftime("%d.%m.%Y %H:%M") if getattr(w, "created_at", None) else ""
-            text_lines.append(
-                f"│   {idx}. {link} — <b>за</b>: {w.reason or 'Причина не указана'}; <b>до</b>: ({rem}); <b>выдал</b>: {issuer_link} {created}"
-            )
+    start = (page - 1) * WARNS_PER_PAGE
+    for idx, w in enumerate(page_warns, start=start + 1):
+        rem = format_timedelta_remaining(w.until) if w.until else "без срока"
+        link = user_link(w.user_id, names[(chat_id, w.user_id)])
+        # Показываем кто выдал предупреждение и причину
+        issuer_link = user_link(w.issued_by, names[(chat_id, w.issued_by)]) if w.issued_by else "Система"
+        created = w.created_at.strftime("%d.%m.%Y %H:%M") if getattr(w, "created_at", None) else ""
+        text_lines.append(
+            f"│   {idx}. {link} — <b>за</b>: {w.reason or 'Причина не указана'}; <b>до</b>: ({rem}); <b>выдал</b>: {issuer_link} {created}"
+        )
 
     text_lines.append(f"└─ <b>Страница:</b> {page}/{total_pages}")
-    kb = page_kb(page, prefix="warns")
-    await message.reply("\n".join(text_lines), reply_markup=kb, parse_mode="HTML")
+    first, last = page_warns[0], page_warns[-1]
+    kb = page_kb(page, prefix="warns",
+                 prev_cursor=encode_cursor(first.created_at, first.id),
+                 next_cursor=encode_cursor(last.created_at, last.id))
+    return "\n".join(text_lines), kb, total
+
+
+@router.message(Cmd("?пред", "?варн"))
+async def cmd_list_warns(message: Message, cmd: ParsedCommand, session: AsyncSession):
+    chat_id = message.chat.id
+    # Единственный допустимый аргумент — номер страницы
+    if len(cmd.args) > 1 or (cmd.args and not cmd.args[0].isdigit()):
+        return
+    page = 1
+    # Если указан номер страницы в аргументе — используем его
+    if cmd.args:
+        page = max(1, int(cmd.args[0]))
+
+    # Если команда вызвана как reply — показываем предупреждения конкретного игрока
+    target_user_id = None
+    if message.reply_to_message and message.reply_to_message.from_user:
+        target_user_id = message.reply_to_message.from_user.id
+
+    text, kb, total = await render_warns_page(chat_id, message.bot, session, target_user_id, page)
+    if total == 0:
+        if target_user_id:
+            target_display = await format_user_link(chat_id, target_user_id, message.bot, session)
+            outbox.submit(message.reply(f"ℹ️ {target_display} не имеет активных предупреждений.", parse_mode="HTML"))
+        else:
+            outbox.submit(message.reply("ℹ️ В чате нет активных предупреждений.", parse_mode="HTML"))
+        return
+
+    outbox.submit(message.reply(text, reply_markup=kb, parse_mode="HTML"))
 
 
 @router.callback_query(lambda c: c.data and c.data.startswith("warns:"))
-async def cb_warns_page(query: CallbackQuery):
-    parts = query.data.split(":")
+async def cb_warns_page(query: CallbackQuery, session: AsyncSession):
+    # warns:<page>[:<p|n>:<cursor>]
+    parts = query.data.split(":", 3)
     try:
         page = int(parts[1])
     except Exception:
         page = 1
     if page < 1:
         page = 1
-    per_page = 10
+    direction = "n"
+    cursor = None
+    if len(parts) == 4:
+        direction = parts[2]
+        cursor = decode_cursor(parts[3])
     chat_id = query.message.chat.id
 
     # Поддерживаем ту же логику: если сообщение-источник было reply к пользователю,
     # то в навигации остаёмся в контексте этого пользователя.
     target_user_id = None
-    target_display = None
     if query.message.reply_to_message and query.message.reply_to_message.from_user:
         target_user_id = query.message.reply_to_message.from_user.id
 
-    async with AsyncSessionLocal() as session:
-        if target_user_id:
-            q = await session.execute(
-                select(Warn).where(Warn.chat_id == chat_id, Warn.active == True, Warn.user_id == target_user_id)
-                .order_by(Warn.created_at.desc()))
-            warns = q.scalars().all()
-            target_display = await format_user_link(chat_id, target_user_id, query.bot, session)
-        else:
-            q = await session.execute(
-                select(Warn).where(Warn.chat_id == chat_id, Warn.active == True).order_by(Warn.created_at.desc()))
-            warns = q.scalars().all()
-
-    total = len(warns)
-    # Если предупреждений уже нет — НЕ редактируем сообщение и НЕ отправляем текст.
+    text, kb, total = await render_warns_page(chat_id, query.bot, session, target_user_id, page, cursor, direction)
+    # Если предупреждений уже нет (или листать дальше некуда) — НЕ редактируем сообщение и НЕ отправляем текст.
     # Просто закрываем callback, чтобы не показывать лишние уведомления пользователю.
-    if total == 0:
+    if text is None:
         await query.answer()  # silently acknowledge the callback
         return
 
-    total_pages = max(1, (total + per_page - 1) // per_page)
-    if page > total_pages:
-        page = total_pages
-
-    start = (page - 1) * per_page
-    page_warns = warns[start:start + per_page]
-
-    text_lines = []
-    header = "⚠️ Активные предупреждения"
-    if target_user_id:
-        header = f"⚠️ Активные предупреждения для {target_display}"
-    text_lines.append(f"<b>{header}</b>")
-    text_lines.append(f"┌─ <b>Всего активных предупреждений:</b> {total}")
-    text_lines.append("├─ <b>Список предупреждений:</b>")
-
-    async with AsyncSessionLocal() as session:
-        for idx, w in enumerate(page_warns, start=start + 1):
-            rem = format_timedelta_remaining(w.until) if w.until else "без срока"
-            link = await format_user_link(chat_id, w.user_id, query.bot, session)
-            issuer_link = await format_user_link(chat_id, w.issued_by, query.bot, session) if w.issued_by else "Система"
-            created = w.created_at.strftime("%d.%m.%Y %H:%M") if getattr(w, "created_at", None) else ""
-            text_lines.append(
-                f"│   {idx}. {link} — <b>за</b>: {w.reason or 'Причина не указана'}; <b>до</b>: ({rem}); <b>выдал</b>: {issuer_link} {created}"
-            )
-
-    text_lines.append(f"└─ <b>Страница:</b> {page}/{total_pages}")
-    kb = page_kb(page, prefix="warns")
-    try:
-        await query.message.edit_text("\n".join(text_lines), reply_markup=kb, parse_mode="HTML")
-    except Exception:
-        await query.answer("Не удалось обновить сообщение.", show_alert=False)
-        return
+    # acknowledge right away; the edit waits for the chat's send queue outside the handler
     await query.answer()
+    outbox.submit(query.message.edit_text(text, reply_markup=kb, parse_mode="HTML"))
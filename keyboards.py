@@ -1,13 +1,21 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
 
-def page_kb(page: int, prefix: str = "page"):
+def page_kb(page: int, prefix: str = "page", prev_cursor: str = None, next_cursor: str = None):
     """
     Returns InlineKeyboardMarkup with Prev and Next buttons.
     Constructed explicitly using inline_keyboard field to satisfy pydantic validation.
+    With cursors the buttons carry keyset positions: "<prefix>:<page>:p|n:<cursor>"
+    (p = rows before prev_cursor, n = rows after next_cursor).
     """
-    prev = InlineKeyboardButton(text="⬅️", callback_data=f"{prefix}:{max(1, page-1)}")
-    nxt = InlineKeyboardButton(text="➡️", callback_data=f"{prefix}:{page+1}")
+    if prev_cursor:
+        prev = InlineKeyboardButton(text="⬅️", callback_data=f"{prefix}:{max(1, page-1)}:p:{prev_cursor}")
+    else:
+        prev = InlineKeyboardButton(text="⬅️", callback_data=f"{prefix}:{max(1, page-1)}")
+    if next_cursor:
+        nxt = InlineKeyboardButton(text="➡️", callback_data=f"{prefix}:{page+1}:n:{next_cursor}")
+    else:
+        nxt = InlineKeyboardButton(text="➡️", callback_data=f"{prefix}:{page+1}")
     # Two buttons in one row
     kb = InlineKeyboardMarkup(inline_keyboard=[[prev, nxt]])
     return kb
\ No newline at end of file
@@ -0,0 +1,121 @@
+import asyncio
+import logging
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.types import Update
+
+from commands import registry
+from config import cfg
+from middlewares.scheduler import ChatSchedulerMiddleware
+from services.metrics import metrics
+from services.roles import role_index
+
+logger = logging.getLogger(__name__)
+
+# Commands from users without a role and button clicks are kept until the
+# backlog is this many times over the limits; plain messages go first.
+HARD_LIMIT_FACTOR = 2
+
+CHATTER = "chatter"
+COMMAND = "command"
+CALLBACK = "callback"
+
+
+class AdmissionMiddleware(BaseMiddleware):
+    """
+    Outer update middleware in front of ChatSchedulerMiddleware: decides
+    whether an update is queued at all. While a chat has more than
+    `chat_limit` updates queued, or all chats together more than
+    `high_water`, plain messages are dropped before any filter runs. Past
+    HARD_LIMIT_FACTOR times the limits, commands from users without a role
+    and callback queries are dropped too. Commands from users with a role
+    (and bot creators), membership updates and everything else are always
+    admitted. Nothing here awaits, so admitted updates keep their order:
+    roles of a group are loaded in the background as soon as the chat is
+    first seen, and until that one query is back every command counts as
+    coming from staff.
+    """
+
+    def __init__(self, scheduler: ChatSchedulerMiddleware, chat_limit: int, high_water: int):
+        self.scheduler = scheduler
+        self.chat_limit = chat_limit
+        self.high_water = high_water
+        self._creators = cfg.CREATOR_IDS
+        self.admitted = 0
+        self.shed: Dict[str, int] = {CHATTER: 0, COMMAND: 0, CALLBACK: 0}
+        self._role_loads: Dict[int, asyncio.Task] = {}
+
+    def _load_roles(self, chat_id: int):
+        if chat_id in self._role_loads:
+            return
+        task = asyncio.create_task(role_index.roles(chat_id))
+        self._role_loads[chat_id] = task
+        task.add_done_callback(partial(self._roles_loaded, chat_id))
+
+    def _roles_loaded(self, chat_id: int, task: asyncio.Task):
+        del self._role_loads[chat_id]
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("Could not load roles of chat %s: %s", chat_id, task.exception())
+
+    def _is_staff(self, chat_id: int, user_id: int) -> bool:
+        if user_id in self._creators:
+            return True
+        roles = role_index.cached(chat_id)
+        # still loading (started when the chat was first seen): don't shed a moderator on a guess
+        return roles is None or user_id in roles
+
+    def _classify(self, event: Update):
+        """Class of a sheddable update, or None if it must always be admitted."""
+        message = event.message
+        if message is not None:
+            if registry.match(message.text) is None:
+                return CHATTER
+            user = message.from_user
+            if user is not None and self._is_staff(message.chat.id, user.id):
+                return None
+            return COMMAND
+        if event.edited_message is not None:
+            return CHATTER
+        if event.callback_query is not None:
+            return CALLBACK
+        return None
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        chat = data.get("event_chat")
+        if chat is not None and chat.type != "private" and role_index.cached(chat.id) is None:
+            self._load_roles(chat.id)
+        scheduler = self.scheduler
+        depth = scheduler.depth(scheduler.lane_key(data))
+        waiting = scheduler.waiting
+        if depth >= self.chat_limit or waiting >= self.high_water:
+            kind = self._classify(event)
+            if kind is not None:
+                hard = (depth >= self.chat_limit * HARD_LIMIT_FACTOR
+                        or waiting >= self.high_water * HARD_LIMIT_FACTOR)
+                if kind == CHATTER or hard:
+                    self.shed[kind] += 1
+                    return UNHANDLED
+        self.admitted += 1
+        return await handler(event, data)
+
+    def stats(self) -> dict:
+        return {"admitted": self.admitted, "shed": dict(self.shed), **self.scheduler.stats()}
+
+    def collect(self):
+        """Metrics collector: shed counters and the scheduler's queue."""
+        metrics.set_counter("woxl_updates_shed_total", "Updates dropped by admission control, by class.",
+                            ("class",), dict(self.shed))
+        metrics.set_counter("woxl_updates_admitted_total", "Updates let through admission control.",
+                            (), {(): self.admitted})
+        stats = self.scheduler.stats()
+        metrics.set_gauge("woxl_updates_running", "Updates being handled right now.", stats["running"])
+        metrics.set_gauge("woxl_updates_queued", "Updates waiting for their chat or a free slot.", stats["waiting"])
+        metrics.set_gauge("woxl_busy_chats", "Chats with updates running or queued.", stats["active_chats"])
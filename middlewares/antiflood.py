@@ -0,0 +1,30 @@
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+from services.antiflood import AntiFlood
+
+
+class AntiFloodMiddleware(BaseMiddleware):
+    """
+    Outer update middleware: feeds every group message into the anti-flood
+    detector. Registered before admission control so messages that get shed
+    during a raid still count. Nothing here awaits.
+    """
+
+    def __init__(self, antiflood: AntiFlood):
+        self.antiflood = antiflood
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        message = event.message
+        if (message is not None and message.chat.type != "private" and message.from_user is not None
+                and message.sender_chat is None and not message.from_user.is_bot):
+            self.antiflood.check(message, time.monotonic())
+        return await handler(event, data)
@@ -0,0 +1,22 @@
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import Message
+
+from commands import registry
+
+
+class CommandMiddleware(BaseMiddleware):
+    """
+    Outer message middleware: tokenizes the first word once and stores the
+    registry match as data["cmd"] (None for ordinary chat messages).
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[Message, Dict[str, Any]], Awaitable[Any]],
+        event: Message,
+        data: Dict[str, Any],
+    ) -> Any:
+        data["cmd"] = registry.match(event.text)
+        return await handler(event, data)
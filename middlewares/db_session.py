@@ -0,0 +1,31 @@
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+
+class DbSessionMiddleware(BaseMiddleware):
+    """
+    Inner middleware: handlers that declare a `session` parameter get one
+    AsyncSession for the whole update. The session checks out a connection
+    only on first use; whatever is still pending when the handler returns is
+    committed, an exception rolls it back. Other handlers pay nothing.
+    """
+
+    def __init__(self, session_factory):
+        self.session_factory = session_factory
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if "session" not in data["handler"].params:
+            return await handler(event, data)
+        async with self.session_factory() as session:
+            data["session"] = session
+            result = await handler(event, data)
+            if session.in_transaction():
+                await session.commit()
+            return result
@@ -0,0 +1,34 @@
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+from services.names import member_names
+from services.recent import recent_authors
+
+
+class MemberNamesMiddleware(BaseMiddleware):
+    """
+    Outer update middleware: remembers display names of everyone we see in
+    incoming messages, so list renderers rarely need get_chat_member, and who
+    wrote each recent message, for bulk commands.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        message = event.message or event.edited_message
+        if message is not None and message.from_user:
+            member_names.put(message.chat.id, message.from_user.id, message.from_user.full_name)
+            if event.message is not None and not message.from_user.is_bot:
+                recent_authors.record(message.chat.id, message.message_id, message.from_user.id)
+            reply = message.reply_to_message
+            if reply is not None and reply.from_user:
+                member_names.put(message.chat.id, reply.from_user.id, reply.from_user.full_name)
+        elif event.callback_query is not None and event.callback_query.message is not None:
+            query = event.callback_query
+            member_names.put(query.message.chat.id, query.from_user.id, query.from_user.full_name)
+        return await handler(event, data)
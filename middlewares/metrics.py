@@ -0,0 +1,66 @@
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import TelegramObject, Update
+
+from services.metrics import UpdateStats, current_update, metrics
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """
+    Outer update middleware: times the whole update and opens the UpdateStats
+    that the statement counter, the API middleware, HandlerLabelMiddleware and
+    the scheduler (queue wait, reported separately from handler time) fill in.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        stats = UpdateStats()
+        token = current_update.set(stats)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            metrics.observe_update(event.event_type, stats, time.perf_counter() - started)
+            current_update.reset(token)
+
+
+class HandlerLabelMiddleware(BaseMiddleware):
+    """Inner middleware: records which router/handler took the update."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        stats = current_update.get()
+        if stats is not None:
+            stats.label = (data["event_router"].name, data["handler"].callback.__name__)
+        return await handler(event, data)
+
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    """Bot session middleware: counts outgoing API requests by method."""
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        try:
+            result = await make_request(bot, method)
+        except Exception:
+            metrics.count_api_request(type(method).__name__, failed=True)
+            raise
+        metrics.count_api_request(type(method).__name__, failed=False)
+        return result
@@ -0,0 +1,132 @@
+"""
+N+1 detector for development and test runs (QUERY_WATCH=warn|raise).
+
+While a handler runs, every SQL statement it executes is recorded under its
+normalized shape (literals and IN-lists collapsed) together with the first
+place in our code that issued it. When the handler returns, a shape repeated
+more than QUERY_WATCH_LIMIT times, or more than QUERY_WATCH_BUDGET statements
+in total, is reported with the handler and call site: logged in "warn" mode,
+raised as QueryBudgetExceeded in "raise" mode.
+"""
+import logging
+import os
+import re
+import sys
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import greenlet
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + os.sep
+_SKIP_FILES = (os.path.abspath(__file__), os.path.join(_ROOT, "db.py"))
+
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_SPACE = re.compile(r"\s+")
+
+
+class QueryBudgetExceeded(RuntimeError):
+    pass
+
+
+def normalize_sql(statement: str) -> str:
+    shape = _STRING.sub("?", statement)
+    shape = _NUMBER.sub("?", shape)
+    shape = _SPACE.sub(" ", shape).strip()
+    return _IN_LIST.sub("(?)", shape)
+
+
+def _repo_frame(frame) -> Optional[str]:
+    """First frame in this repository outside db.py and this module."""
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(_ROOT) and filename not in _SKIP_FILES:
+            return f"{filename[len(_ROOT):]}:{frame.f_lineno} in {frame.f_code.co_name}"
+        frame = frame.f_back
+    return None
+
+
+def _call_site() -> str:
+    site = _repo_frame(sys._getframe(2))
+    if site is None:
+        # AsyncSession runs the driver in a greenlet; the awaiting code is on the parent's stack
+        parent = greenlet.getcurrent().parent
+        if parent is not None:
+            site = _repo_frame(parent.gr_frame)
+    return site or "<unknown>"
+
+
+class QueryLog:
+    __slots__ = ("label", "total", "shapes")
+
+    def __init__(self, label: str):
+        self.label = label
+        self.total = 0
+        # shape -> [count, first call site]
+        self.shapes: Dict[str, List] = {}
+
+    def record(self, statement: str):
+        self.total += 1
+        shape = normalize_sql(statement)
+        entry = self.shapes.get(shape)
+        if entry is None:
+            self.shapes[shape] = [1, _call_site()]
+        else:
+            entry[0] += 1
+
+    def problems(self, limit: int, budget: int) -> List[str]:
+        found = []
+        for shape, (count, site) in self.shapes.items():
+            if count > limit:
+                found.append(f"{count}x at {site}: {shape}")
+        if budget and self.total > budget:
+            found.append(f"{self.total} statements, budget is {budget}")
+        return found
+
+
+_current: ContextVar[Optional[QueryLog]] = ContextVar("querywatch", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    log = _current.get()
+    if log is not None:
+        log.record(statement)
+
+
+def watch_engine(engine):
+    event.listen(engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+
+
+class QueryWatchMiddleware(BaseMiddleware):
+    """Inner middleware: collects the statements of one handler call and checks them."""
+
+    def __init__(self, mode: str, limit: int, budget: int = 0):
+        self.mode = mode
+        self.limit = limit
+        self.budget = budget
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        log = QueryLog(f"{data['event_router'].name}.{data['handler'].callback.__name__}")
+        token = _current.set(log)
+        try:
+            result = await handler(event, data)
+        finally:
+            _current.reset(token)
+        problems = log.problems(self.limit, self.budget)
+        if problems:
+            report = f"Query budget exceeded in {log.label}:\n  " + "\n  ".join(problems)
+            if self.mode == "raise":
+                raise QueryBudgetExceeded(report)
+            logger.warning(report)
+        return result
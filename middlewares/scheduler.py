@@ -0,0 +1,97 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+from services.metrics import current_update
+
+
+class _ChatLane:
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        # updates of this chat that are running or waiting
+        self.users = 0
+
+
+class ChatSchedulerMiddleware(BaseMiddleware):
+    """
+    Outer update middleware: updates of one chat are handled one at a time,
+    in arrival order, and at most `max_concurrency` updates run at once
+    across all chats. Read-modify-write handlers (role changes, nicks) can't
+    interleave within a chat, and a flood can't check out more connections
+    than there are slots. A chat's lane is dropped as soon as nothing of it
+    is queued, so memory follows the number of busy chats.
+
+    Ordering relies on updates entering the middleware in the order they were
+    received; polling, the webhook server and workers create their tasks in
+    that order and nothing before this middleware awaits.
+    """
+
+    def __init__(self, max_concurrency: int):
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self.max_concurrency = max_concurrency
+        self._lanes: Dict[int, _ChatLane] = {}
+        self.pending = 0
+        self.running = 0
+
+    @staticmethod
+    def lane_key(data: Dict[str, Any]) -> int:
+        """Chat id (user id for chatless updates, 0 if there is neither), as in workers.chat_key."""
+        chat = data.get("event_chat")
+        if chat is not None:
+            return chat.id
+        user = data.get("event_from_user")
+        if user is not None:
+            return user.id
+        return 0
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        key = self.lane_key(data)
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = _ChatLane()
+        lane.users += 1
+        self.pending += 1
+        queued = time.perf_counter()
+        try:
+            # chat first, slot second: a chat's backlog waits without holding slots
+            async with lane.lock:
+                async with self._slots:
+                    stats = current_update.get()
+                    if stats is not None:
+                        stats.queued = time.perf_counter() - queued
+                    self.running += 1
+                    try:
+                        return await handler(event, data)
+                    finally:
+                        self.running -= 1
+        finally:
+            lane.users -= 1
+            self.pending -= 1
+            if not lane.users:
+                del self._lanes[key]
+
+    def depth(self, key: int) -> int:
+        """Updates of the chat that are running or waiting."""
+        lane = self._lanes.get(key)
+        return lane.users if lane is not None else 0
+
+    @property
+    def waiting(self) -> int:
+        return self.pending - self.running
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "waiting": self.waiting,
+            "active_chats": len(self._lanes),
+        }
@@ -0,0 +1,69 @@
+"""
+Versioned schema migrations.
+
+create_all() only creates missing tables, so anything added to an existing
+table later (indexes, constraints, data fixes) goes here as a numbered step.
+Applied versions are recorded in the schema_version table; every step must be
+safe to run on a database that create_all() has just built from models.py.
+"""
+import logging
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, select, text
+
+import models  # noqa: F401 -- registers the tables on Base.metadata
+from db import Base
+
+logger = logging.getLogger(__name__)
+
+schema_version = Table(
+    "schema_version",
+    MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("description", String(255)),
+    Column("applied_at", DateTime, default=datetime.utcnow),
+)
+
+# (version, description, fn(sync_connection))
+MIGRATIONS = []
+
+
+def migration(version: int, description: str):
+    def decorator(fn):
+        MIGRATIONS.append((version, description, fn))
+        return fn
+    return decorator
+
+
+def _create_index(conn, table_name: str, index_name: str):
+    table = Base.metadata.tables[table_name]
+    index = next(i for i in table.indexes if i.name == index_name)
+    index.create(conn, checkfirst=True)
+
+
+@migration(1, "composite warn indexes, unique nick per chat user")
+def _warn_and_nick_indexes(conn):
+    # Keep the oldest row of each duplicated nick: that is the one handlers were reading
+    conn.execute(text(
+        "DELETE FROM nicks WHERE id NOT IN (SELECT MIN(id) FROM nicks GROUP BY chat_id, user_id)"
+    ))
+    _create_index(conn, "nicks", "uq_nicks_chat_user")
+    _create_index(conn, "warns", "ix_warns_chat_active_created")
+    _create_index(conn, "warns", "ix_warns_chat_active_user_created")
+
+
+@migration(2, "warn expiry index")
+def _warn_expiry_index(conn):
+    _create_index(conn, "warns", "ix_warns_active_until")
+
+
+def run_migrations(conn):
+    """Apply pending migrations; meant for AsyncConnection.run_sync inside a transaction."""
+    schema_version.create(conn, checkfirst=True)
+    current = conn.execute(select(func.max(schema_version.c.version))).scalar() or 0
+    for version, description, fn in sorted(MIGRATIONS, key=lambda m: m[0]):
+        if version <= current:
+            continue
+        fn(conn)
+        conn.execute(schema_version.insert().values(version=version, description=description))
+        logger.info("Applied schema migration %s: %s", version, description)
@@ -1,5 +1,5 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Boolean, Text, ForeignKey, UniqueConstraint
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Boolean, Text, ForeignKey, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from db import Base
 
@@ -42,6 +42,10 @@ class Nick(Base):
     nick = Column(String(64), nullable=False)
     updated_at = Column(DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        Index("uq_nicks_chat_user", "chat_id", "user_id", unique=True),
+    )
+
 
 class Warn(Base):
     __tablename__ = "warns"
@@ -52,4 +56,36 @@ class Warn(Base):
     reason = Column(Text, nullable=True)
     until = Column(DateTime, nullable=True)
     active = Column(Boolean, default=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
\ No newline at end of file
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        # active list of a chat, newest first (keyset on created_at, id)
+        Index("ix_warns_chat_active_created", "chat_id", "active", "created_at", "id"),
+        # active list / latest active warn of one user
+        Index("ix_warns_chat_active_user_created", "chat_id", "active", "user_id", "created_at", "id"),
+        # expiry scheduler: pending deadlines and the bulk UPDATE
+        Index("ix_warns_active_until", "active", "until"),
+    )
+
+
+class Broadcast(Base):
+    __tablename__ = "broadcasts"
+    id = Column(Integer, primary_key=True)
+    text = Column(Text, nullable=False)
+    created_by = Column(BigInteger, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+
+class BroadcastDelivery(Base):
+    __tablename__ = "broadcast_deliveries"
+    id = Column(Integer, primary_key=True)
+    broadcast_id = Column(Integer, ForeignKey("broadcasts.id", ondelete="CASCADE"), nullable=False)
+    chat_id = Column(BigInteger, nullable=False)
+    ok = Column(Boolean, nullable=False)
+    error = Column(Text, nullable=True)
+    sent_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint("broadcast_id", "chat_id", name="uq_broadcast_chat"),
+    )
@@ -0,0 +1,50 @@
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from config import cfg
+
+
+class AdminListCache:
+    """
+    Rendered "админы" message per chat.
+    Every change to roles or nicks of a chat bumps its version; a cached text
+    is served only while its version is current and it is younger than ttl
+    (Telegram names can change without us noticing).
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._versions: Dict[int, int] = {}
+        self._rendered: "OrderedDict[int, Tuple[int, float, str]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def version(self, chat_id: int) -> int:
+        return self._versions.get(chat_id, 0)
+
+    def bump(self, chat_id: int):
+        self._versions[chat_id] = self._versions.get(chat_id, 0) + 1
+        self._rendered.pop(chat_id, None)
+
+    def get(self, chat_id: int) -> Optional[str]:
+        entry = self._rendered.get(chat_id)
+        if entry is None or entry[0] != self.version(chat_id) or entry[1] <= time.monotonic():
+            self.misses += 1
+            return None
+        self._rendered.move_to_end(chat_id)
+        self.hits += 1
+        return entry[2]
+
+    def put(self, chat_id: int, version: int, text: str):
+        """Store text rendered at `version`; dropped if the chat changed while rendering."""
+        if version != self.version(chat_id):
+            return
+        self._rendered[chat_id] = (version, time.monotonic() + self.ttl, text)
+        self._rendered.move_to_end(chat_id)
+        while len(self._rendered) > self.maxsize:
+            self._rendered.popitem(last=False)
+
+
+admin_lists = AdminListCache(cfg.ADMIN_LIST_CACHE_SIZE, cfg.NAME_CACHE_TTL)
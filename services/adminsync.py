@@ -0,0 +1,172 @@
+"""
+Periodic sync of chat owners with Telegram.
+
+Owners are otherwise only detected when the bot is added to a chat. Every
+ADMIN_SYNC_INTERVAL seconds the group chats in the chats table are walked in
+keyset chunks; administrator lists are fetched concurrently (bounded by a
+semaphore and a token bucket) and compared with the stored owner rows. Only
+chats whose owner changed are written, one transaction per chunk. A former
+owner keeps administrator rights (role 4) instead of being removed.
+"""
+import asyncio
+import logging
+import time
+from typing import Dict, Optional, Set, Tuple
+
+from aiogram.exceptions import TelegramRetryAfter
+from sqlalchemy import select
+
+from config import cfg
+from db import AsyncSessionLocal
+from models import Chat, RoleAssignment
+from services.adminlist import admin_lists
+from services.metrics import metrics
+from services.names import member_names
+from services.outbox import TokenBucket
+from services.roles import role_index
+from upserts import upsert_role
+
+logger = logging.getLogger(__name__)
+
+OWNER_ROLE = 5
+FORMER_OWNER_ROLE = 4
+# Delay before the first sync after startup, seconds
+FIRST_RUN_DELAY = 60
+
+
+class AdminSync:
+    def __init__(self, interval: float, concurrency: int, rate: float, chunk_size: int):
+        self.interval = interval
+        self.concurrency = concurrency
+        self.rate = rate
+        self.chunk_size = chunk_size
+        self.last_run: Optional[dict] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def _fetch_owner(self, bot, chat_id: int, slots: asyncio.Semaphore, bucket: TokenBucket) -> Optional[int]:
+        """Current creator's user id, or None if the list could not be fetched."""
+        async with slots:
+            for attempt in range(2):
+                delay = bucket.reserve()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                try:
+                    admins = await bot.get_chat_administrators(chat_id)
+                    break
+                except TelegramRetryAfter as e:
+                    if attempt:
+                        return None
+                    await asyncio.sleep(e.retry_after)
+                except Exception as e:
+                    # kicked, chat deleted or migrated -- try again next run
+                    logger.debug("No administrators for chat %s: %s", chat_id, e)
+                    return None
+        owner = None
+        for a in admins:
+            member_names.put(chat_id, a.user.id, a.user.full_name)
+            if a.status == "creator":
+                owner = a.user.id
+        return owner
+
+    async def sync(self, bot, partition: Tuple[int, int] = (0, 1)) -> dict:
+        """
+        One pass over all group chats. With partition=(index, count) only chats
+        with chat_id % count == index are synced (one partition per worker process).
+        """
+        index, count = partition
+        slots = asyncio.Semaphore(self.concurrency)
+        bucket = TokenBucket(self.rate, max(1.0, self.rate))
+        started = time.monotonic()
+        chats = changed = failed = 0
+        last_chat_id: Optional[int] = None
+
+        while True:
+            async with AsyncSessionLocal() as session:
+                # group chats have negative ids; private chats have no administrators
+                stmt = select(Chat.id).where(Chat.id < 0).order_by(Chat.id).limit(self.chunk_size)
+                if last_chat_id is not None:
+                    stmt = stmt.where(Chat.id > last_chat_id)
+                chunk = (await session.execute(stmt)).scalars().all()
+                if not chunk:
+                    break
+                last_chat_id = chunk[-1]
+                chunk = [chat_id for chat_id in chunk if chat_id % count == index]
+                if not chunk:
+                    continue
+                q = await session.execute(
+                    select(RoleAssignment.chat_id, RoleAssignment.user_id)
+                    .where(RoleAssignment.chat_id.in_(chunk), RoleAssignment.role_id == OWNER_ROLE))
+                stored: Dict[int, Set[int]] = {}
+                for chat_id, user_id in q.all():
+                    stored.setdefault(chat_id, set()).add(user_id)
+
+            owners = await asyncio.gather(*(self._fetch_owner(bot, chat_id, slots, bucket) for chat_id in chunk))
+            chats += len(chunk)
+
+            writes = []
+            for chat_id, owner in zip(chunk, owners):
+                if owner is None:
+                    failed += 1
+                    continue
+                previous = stored.get(chat_id, set())
+                if previous == {owner}:
+                    continue
+                changed += 1
+                if owner not in previous:
+                    writes.append((chat_id, owner, OWNER_ROLE))
+                writes.extend((chat_id, user_id, FORMER_OWNER_ROLE) for user_id in previous if user_id != owner)
+
+            if writes:
+                async with AsyncSessionLocal() as session:
+                    for chat_id, user_id, role_id in writes:
+                        await upsert_role(session, chat_id, user_id, role_id)
+                    await session.commit()
+                for chat_id, user_id, role_id in writes:
+                    role_index.set(chat_id, user_id, role_id)
+                    admin_lists.bump(chat_id)
+
+        seconds = time.monotonic() - started
+        self.last_run = {
+            "chats": chats,
+            "changed": changed,
+            "failed": failed,
+            "seconds": round(seconds, 3),
+            "chats_per_sec": round(chats / seconds, 1) if seconds else 0.0,
+        }
+        metrics.set_gauge("woxl_admin_sync_duration_seconds", "Duration of the last administrator sync.", seconds)
+        metrics.set_gauge("woxl_admin_sync_chats_per_second", "Chats processed per second by the last sync.",
+                          self.last_run["chats_per_sec"])
+        metrics.set_gauge("woxl_admin_sync_changed", "Chats whose owner changed in the last sync.", changed)
+        logger.info("Admin sync: %s chats in %.1fs (%.1f/s), %s changed, %s failed",
+                    chats, seconds, self.last_run["chats_per_sec"], changed, failed)
+        return self.last_run
+
+    async def run(self, bot, partition: Tuple[int, int] = (0, 1)):
+        await asyncio.sleep(FIRST_RUN_DELAY)
+        while True:
+            try:
+                await self.sync(bot, partition)
+            except Exception as e:
+                logger.exception("Admin sync failed: %s", e)
+            await asyncio.sleep(self.interval)
+
+    def start(self, bot, partition: Tuple[int, int] = (0, 1)):
+        if self.interval > 0:
+            self._task = asyncio.create_task(self.run(bot, partition))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+admin_sync = AdminSync(
+    interval=cfg.ADMIN_SYNC_INTERVAL,
+    concurrency=cfg.ADMIN_SYNC_CONCURRENCY,
+    rate=cfg.ADMIN_SYNC_RATE,
+    chunk_size=cfg.ADMIN_SYNC_CHUNK_SIZE,
+)
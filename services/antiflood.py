@@ -0,0 +1,160 @@
+"""
+Anti-flood: automatic warns for users who post too fast.
+
+Every (chat, user) pair gets a ring buffer with the times of its last few
+messages. The buffers are rows of one preallocated array, so tracking a
+user costs a few dozen bytes and no allocation per message; the least
+recently active pair gives its row to a new one once `capacity` pairs are
+tracked. A message is a flood when the message `limit - 1` positions back
+in the ring is younger than `window` -- one lookup, no scan. A flood
+lasts until the user has been quiet for a whole window, so one burst earns
+one warn however long it goes on.
+
+Detection runs inline for every group message (see middlewares/antiflood.py);
+the warn itself is written in a background task through issue_warn, the
+same path +пред uses.
+"""
+import asyncio
+import logging
+from array import array
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional, Set, Tuple
+
+from aiogram.types import Message
+
+from config import cfg
+from services.metrics import metrics
+from services.names import user_link
+from services.outbox import outbox
+from services.roles import role_index
+from services.warns import issue_warn
+from utils import parse_duration
+
+logger = logging.getLogger(__name__)
+
+REASON = "Флуд"
+
+
+class FloodDetector:
+    def __init__(self, limit: int, window: float, capacity: int):
+        if limit < 2:
+            raise ValueError("the flood limit must be at least 2 messages")
+        self.limit = limit
+        self.window = window
+        self.capacity = capacity
+        # the current message plus limit - 1 earlier ones make a flood
+        self._size = size = limit - 1
+        self._times = array("d", bytes(8 * size * capacity))
+        self._heads = array("I", bytes(4 * capacity))
+        # after a flood, messages until this time extend it instead of starting a new one
+        self._quiet_until = array("d", bytes(8 * capacity))
+        self._blank = array("d", bytes(8 * size))
+        self._rows: "OrderedDict[Tuple[int, int], int]" = OrderedDict()
+        self.evicted = 0
+
+    def hit(self, chat_id: int, user_id: int, now: float) -> bool:
+        """
+        Record a message; True when it completes a flood. The user's history is
+        then cleared and the flood lasts until they stay quiet for a whole
+        window, so one burst is reported once.
+        """
+        key = (chat_id, user_id)
+        rows = self._rows
+        size = self._size
+        row = rows.get(key)
+        if row is None:
+            if len(rows) < self.capacity:
+                row = len(rows)
+            else:
+                _, row = rows.popitem(last=False)
+                self.evicted += 1
+                self._times[row * size:(row + 1) * size] = self._blank
+                self._heads[row] = 0
+                self._quiet_until[row] = 0.0
+            rows[key] = row
+        else:
+            rows.move_to_end(key)
+
+        if now < self._quiet_until[row]:
+            self._quiet_until[row] = now + self.window
+            return False
+
+        head = self._heads[row]
+        i = row * size + head
+        oldest = self._times[i]
+        self._times[i] = now
+        self._heads[row] = head + 1 if head + 1 < size else 0
+        if oldest and now - oldest < self.window:
+            # the next warn needs a fresh burst after a quiet window
+            self._times[row * size:(row + 1) * size] = self._blank
+            self._quiet_until[row] = now + self.window
+            return True
+        return False
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+
+class AntiFlood:
+    def __init__(self, limit: int, window: float, capacity: int, warn_duration: str):
+        self.detector = FloodDetector(limit, window, capacity)
+        self.warn_duration = parse_duration(warn_duration) if warn_duration else None
+        self._creators = cfg.CREATOR_IDS
+        self._tasks: Set[asyncio.Task] = set()
+        self.floods = 0
+        self.warned = 0
+
+    def check(self, message: Message, now: float):
+        user = message.from_user
+        if self.detector.hit(message.chat.id, user.id, now):
+            self.floods += 1
+            task = asyncio.create_task(self._warn(message))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _warn(self, message: Message):
+        chat_id = message.chat.id
+        user = message.from_user
+        try:
+            if user.id in self._creators or await role_index.role_of(chat_id, user.id):
+                return
+            until: Optional[datetime] = datetime.now() + self.warn_duration if self.warn_duration else None
+            await issue_warn(chat_id, user.id, None, REASON, until)
+            self.warned += 1
+            until_text = until.strftime("%H:%M:%S %d.%m.%Y") if until else "без срока"
+            outbox.submit(message.reply(
+                f"⚠️ {user_link(user.id, user.full_name)} получил предупреждение до <b>{until_text}</b> "
+                f"за: <b>{REASON}</b> (автоматически).", parse_mode="HTML"))
+        except Exception as e:
+            logger.exception("Could not warn %s for flooding in chat %s: %s", user.id, chat_id, e)
+
+    async def close(self):
+        """Wait for warns that are still being written."""
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "tracked": len(self.detector),
+            "evicted": self.detector.evicted,
+            "floods": self.floods,
+            "warned": self.warned,
+        }
+
+    def collect(self):
+        """Metrics collector."""
+        metrics.set_counter("woxl_antiflood_floods_total", "Message bursts over the anti-flood limit.",
+                            (), {(): self.floods})
+        metrics.set_counter("woxl_antiflood_warns_total", "Warns issued by the anti-flood.", (), {(): self.warned})
+        metrics.set_gauge("woxl_antiflood_tracked_users", "Chat members whose message times are tracked.",
+                          len(self.detector))
+
+
+# None unless ANTIFLOOD_MESSAGES is set: the detector's table is allocated up front
+antiflood: Optional[AntiFlood] = AntiFlood(
+    limit=max(cfg.ANTIFLOOD_MESSAGES, 2),
+    window=cfg.ANTIFLOOD_WINDOW,
+    capacity=cfg.ANTIFLOOD_TRACKED_USERS,
+    warn_duration=cfg.ANTIFLOOD_WARN_DURATION,
+) if cfg.ANTIFLOOD_MESSAGES else None
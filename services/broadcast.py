@@ -0,0 +1,168 @@
+"""
+Broadcast of one text to every chat in the chats table.
+
+Chat ids are streamed in keyset chunks, each chunk is sent with bounded
+concurrency through the outbox (so flood limits apply) and results are stored
+in broadcast_deliveries as they come in, one transaction per `concurrency`
+completed sends. A broadcast that was interrupted can be resumed: chats that
+already have a delivery row are skipped, so only the sends that were in
+flight or not yet recorded can repeat.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Awaitable, List, Optional, Set
+
+from aiogram.methods import EditMessageText, SendMessage
+from aiogram.types import Message
+from sqlalchemy import func, insert, select, update
+
+from config import cfg
+from db import AsyncSessionLocal
+from models import Broadcast, BroadcastDelivery, Chat
+from services.outbox import outbox
+
+logger = logging.getLogger(__name__)
+
+
+class BroadcastRunner:
+    def __init__(self, concurrency: int, chunk_size: int, progress_interval: float):
+        self.concurrency = concurrency
+        self.chunk_size = chunk_size
+        self.progress_interval = progress_interval
+        self._running: Set[int] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+    def is_running(self, broadcast_id: int) -> bool:
+        return broadcast_id in self._running
+
+    async def create(self, text: str, created_by: int) -> int:
+        async with AsyncSessionLocal() as session:
+            b = Broadcast(text=text, created_by=created_by)
+            session.add(b)
+            await session.commit()
+            return b.id
+
+    async def _deliver(self, bot, chat_id: int, text: str, slots: asyncio.Semaphore):
+        async with slots:
+            try:
+                await outbox.submit(SendMessage(chat_id=chat_id, text=text, parse_mode=cfg.PARSE_MODE).as_(bot))
+            except Exception as e:
+                return {"chat_id": chat_id, "ok": False, "error": str(e)[:500]}
+        return {"chat_id": chat_id, "ok": True, "error": None}
+
+    async def _record(self, broadcast_id: int, results: List[dict]):
+        async with AsyncSessionLocal() as session:
+            await session.execute(insert(BroadcastDelivery), [dict(r, broadcast_id=broadcast_id) for r in results])
+            await session.commit()
+
+    def _report(self, bot, status_chat_id: int, status_message_id: int, text: str):
+        # pending edits of the status message are coalesced by the outbox
+        outbox.submit(EditMessageText(chat_id=status_chat_id, message_id=status_message_id, text=text).as_(bot))
+
+    def start(self, bot, broadcast_id: int, status: Awaitable[Message]):
+        """
+        Run the broadcast in the background. Progress goes to the `status`
+        message once it is sent (an outbox future, so the caller doesn't wait for it).
+        """
+        if broadcast_id in self._running:
+            return
+        self._running.add(broadcast_id)
+        task = asyncio.create_task(self.run(bot, broadcast_id, status))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def run(self, bot, broadcast_id: int, status: Awaitable[Message]):
+        try:
+            try:
+                status_message = await status
+            except Exception:
+                # already logged by the outbox; there is nowhere to report progress to
+                return
+            status_chat_id, status_message_id = status_message.chat.id, status_message.message_id
+            await self._run(bot, broadcast_id, status_chat_id, status_message_id)
+        except Exception as e:
+            logger.exception("Broadcast %s failed: %s", broadcast_id, e)
+            self._report(bot, status_chat_id, status_message_id, f"📣 Рассылка #{broadcast_id} прервана: {e}")
+        finally:
+            self._running.discard(broadcast_id)
+
+    async def _run(self, bot, broadcast_id: int, status_chat_id: int, status_message_id: int):
+        async with AsyncSessionLocal() as session:
+            b = await session.get(Broadcast, broadcast_id)
+            text = b.text
+            total = (await session.execute(select(func.count()).select_from(Chat))).scalar_one()
+            q = await session.execute(
+                select(BroadcastDelivery.ok, func.count())
+                .where(BroadcastDelivery.broadcast_id == broadcast_id)
+                .group_by(BroadcastDelivery.ok))
+            counts = dict(q.all())
+        sent, failed = counts.get(True, 0), counts.get(False, 0)
+        skipped = sent + failed
+
+        slots = asyncio.Semaphore(self.concurrency)
+        started = time.monotonic()
+        last_report = 0.0
+        last_chat_id: Optional[int] = None
+
+        def progress(final: bool = False) -> str:
+            elapsed = max(time.monotonic() - started, 1e-6)
+            rate = (sent + failed - skipped) / elapsed
+            head = "✅ Рассылка завершена" if final else "📣 Рассылка"
+            return f"{head} #{broadcast_id}: {sent + failed}/{total}, ошибок: {failed}, {rate:.1f} сообщ./с"
+
+        while True:
+            async with AsyncSessionLocal() as session:
+                stmt = select(Chat.id).order_by(Chat.id).limit(self.chunk_size)
+                if last_chat_id is not None:
+                    stmt = stmt.where(Chat.id > last_chat_id)
+                chunk = (await session.execute(stmt)).scalars().all()
+                if not chunk:
+                    break
+                last_chat_id = chunk[-1]
+                q = await session.execute(
+                    select(BroadcastDelivery.chat_id)
+                    .where(BroadcastDelivery.broadcast_id == broadcast_id, BroadcastDelivery.chat_id.in_(chunk)))
+                done = set(q.scalars().all())
+
+            todo = [chat_id for chat_id in chunk if chat_id not in done]
+            if not todo:
+                continue
+            deliveries = [asyncio.ensure_future(self._deliver(bot, chat_id, text, slots)) for chat_id in todo]
+            results = []
+            try:
+                for delivery in asyncio.as_completed(deliveries):
+                    r = await delivery
+                    results.append(r)
+                    if r["ok"]:
+                        sent += 1
+                    else:
+                        failed += 1
+                    if len(results) >= self.concurrency:
+                        # record as we go, so a restart repeats at most the unrecorded sends
+                        await self._record(broadcast_id, results)
+                        results = []
+                        now = time.monotonic()
+                        if now - last_report >= self.progress_interval:
+                            last_report = now
+                            self._report(bot, status_chat_id, status_message_id, progress())
+            finally:
+                for delivery in deliveries:
+                    delivery.cancel()
+            if results:
+                await self._record(broadcast_id, results)
+
+        async with AsyncSessionLocal() as session:
+            await session.execute(
+                update(Broadcast).where(Broadcast.id == broadcast_id).values(finished_at=datetime.utcnow()))
+            await session.commit()
+        self._report(bot, status_chat_id, status_message_id, progress(final=True))
+        logger.info("Broadcast %s finished: %s sent, %s failed", broadcast_id, sent, failed)
+
+
+broadcasts = BroadcastRunner(
+    concurrency=cfg.BROADCAST_CONCURRENCY,
+    chunk_size=cfg.BROADCAST_CHUNK_SIZE,
+    progress_interval=cfg.BROADCAST_PROGRESS_INTERVAL,
+)
@@ -0,0 +1,40 @@
+from typing import Set
+
+from sqlalchemy import select
+
+from db import AsyncSessionLocal
+from models import Chat
+from upserts import ensure_chat
+
+
+class ChatRegistry:
+    """
+    In-memory set of chat ids that already have a row in chats.
+    Loaded in one query at startup; ensure() only touches the database the
+    first time a chat is seen, so handlers can call it before every write.
+    """
+
+    def __init__(self):
+        self._known: Set[int] = set()
+
+    async def load(self):
+        async with AsyncSessionLocal() as session:
+            self._known = set((await session.scalars(select(Chat.id))).all())
+
+    async def ensure(self, chat_id: int):
+        if chat_id in self._known:
+            return
+        # Concurrent first sightings are harmless: the insert ignores conflicts
+        async with AsyncSessionLocal() as session:
+            await ensure_chat(session, chat_id)
+            await session.commit()
+        self._known.add(chat_id)
+
+    def __contains__(self, chat_id: int) -> bool:
+        return chat_id in self._known
+
+    def __len__(self) -> int:
+        return len(self._known)
+
+
+chat_registry = ChatRegistry()
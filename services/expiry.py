@@ -0,0 +1,109 @@
+import asyncio
+import heapq
+import logging
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import select, update
+
+from db import AsyncSessionLocal
+from models import Warn
+
+logger = logging.getLogger(__name__)
+
+# Re-check at least this often, so wall clock jumps can't leave warns active for long
+MAX_SLEEP = 3600
+
+
+class WarnExpiryScheduler:
+    """
+    Deactivates timed warns when their `until` passes.
+    Deadlines are kept in a min-heap; the loop sleeps until the earliest one and
+    then expires every due warn with a single bulk UPDATE.
+
+    With partition=(index, count) only warns of chats with
+    chat_id % count == index are handled, so each worker process expires the
+    chats it serves and only has to hear about their deadlines.
+    """
+
+    def __init__(self):
+        self._heap: List[datetime] = []
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._partition: Tuple[int, int] = (0, 1)
+
+    def schedule(self, until: datetime):
+        if self._task is None:
+            # not running in this process; the loop rebuilds from the database on start
+            return
+        heapq.heappush(self._heap, until)
+        if self._heap[0] == until:
+            # new earliest deadline -- let the loop recompute its sleep
+            self._wakeup.set()
+
+    def _in_partition(self, stmt):
+        index, count = self._partition
+        if count == 1:
+            return stmt
+        # Python's modulo, as used for routing: SQL % keeps the sign of the negative chat ids
+        return stmt.where((Warn.chat_id % count + count) % count == index)
+
+    async def _rebuild(self):
+        async with AsyncSessionLocal() as session:
+            q = await session.execute(self._in_partition(
+                select(Warn.until).where(Warn.active == True, Warn.until.isnot(None)).distinct()))
+            stored = q.scalars().all()
+        # keep deadlines that schedule() pushed while the query was running
+        self._heap.extend(stored)
+        heapq.heapify(self._heap)
+
+    async def expire_due(self, now: datetime) -> int:
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(self._in_partition(
+                update(Warn).where(Warn.active == True, Warn.until <= now).values(active=False)))
+            await session.commit()
+        return result.rowcount
+
+    async def run(self):
+        await self._rebuild()
+        logger.info("Warn expiry scheduler started, %s pending deadlines", len(self._heap))
+        while True:
+            # until is stored as local time, see cmd_warn
+            now = datetime.now()
+            if self._heap and self._heap[0] <= now:
+                try:
+                    expired = await self.expire_due(now)
+                except Exception as e:
+                    logger.exception("Could not expire warns: %s", e)
+                    await asyncio.sleep(5)
+                    continue
+                while self._heap and self._heap[0] <= now:
+                    heapq.heappop(self._heap)
+                if expired:
+                    logger.info("Expired %s warns", expired)
+                continue
+
+            timeout = MAX_SLEEP
+            if self._heap:
+                timeout = min(timeout, (self._heap[0] - now).total_seconds())
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self, partition: Tuple[int, int] = (0, 1)):
+        self._partition = partition
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+warn_expiry = WarnExpiryScheduler()
@@ -0,0 +1,196 @@
+"""
+In-process metrics in Prometheus text format.
+
+Nothing here is wired up unless METRICS_PORT is set: bot.py then installs the
+middlewares from middlewares/metrics.py and the SQL statement counter, and
+serves GET /metrics on METRICS_HOST:METRICS_PORT.
+"""
+import bisect
+import logging
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Tuple
+
+from aiohttp import web
+from sqlalchemy import event
+
+from config import cfg
+
+logger = logging.getLogger(__name__)
+
+# Handler latency buckets, seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# Statements / API calls per update
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21)
+
+UNHANDLED = ("", "unhandled")
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.counts):
+            self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class UpdateStats:
+    """Per-update counters, reachable from anywhere in the update's context via current_update."""
+    __slots__ = ("label", "queries", "api_calls", "queued")
+
+    def __init__(self):
+        self.label: Tuple[str, str] = UNHANDLED
+        self.queries = 0
+        self.api_calls = 0
+        # seconds spent waiting in ChatSchedulerMiddleware
+        self.queued = 0.0
+
+
+current_update: ContextVar[Optional[UpdateStats]] = ContextVar("current_update", default=None)
+
+
+class Metrics:
+    def __init__(self):
+        self.updates: Dict[str, int] = {}
+        self.handler_seconds: Dict[Tuple[str, str], Histogram] = {}
+        self.queue_seconds: Dict[Tuple[str, str], Histogram] = {}
+        self.handler_queries: Dict[Tuple[str, str], Histogram] = {}
+        self.handler_api_calls: Dict[Tuple[str, str], int] = {}
+        self.api_requests: Dict[str, int] = {}
+        self.api_errors: Dict[str, int] = {}
+        self.queries = 0
+        self.gauges: Dict[str, Tuple[str, float]] = {}
+        # name -> (help, label names, {label values: count}) for components that keep their own counters
+        self.counters: Dict[str, Tuple[str, Tuple[str, ...], Dict]] = {}
+        # called before every render to refresh gauges and counters
+        self.collectors: List[Callable[[], None]] = []
+
+    def observe_update(self, update_type: str, stats: UpdateStats, seconds: float):
+        self.updates[update_type] = self.updates.get(update_type, 0) + 1
+        label = stats.label
+        hist = self.handler_seconds.get(label)
+        if hist is None:
+            hist = self.handler_seconds[label] = Histogram(LATENCY_BUCKETS)
+            self.queue_seconds[label] = Histogram(LATENCY_BUCKETS)
+            self.handler_queries[label] = Histogram(COUNT_BUCKETS)
+        hist.observe(seconds - stats.queued)
+        self.queue_seconds[label].observe(stats.queued)
+        self.handler_queries[label].observe(stats.queries)
+
+    def count_api_request(self, method: str, failed: bool):
+        self.api_requests[method] = self.api_requests.get(method, 0) + 1
+        if failed:
+            self.api_errors[method] = self.api_errors.get(method, 0) + 1
+        stats = current_update.get()
+        if stats is not None:
+            # outbox sends run in the submitting update's context, so late sends count too
+            stats.api_calls += 1
+            self.handler_api_calls[stats.label] = self.handler_api_calls.get(stats.label, 0) + 1
+
+    def set_gauge(self, name: str, help_text: str, value: float):
+        self.gauges[name] = (help_text, value)
+
+    def set_counter(self, name: str, help_text: str, label_names: Tuple[str, ...], values: Dict):
+        self.counters[name] = (help_text, label_names, values)
+
+    def add_collector(self, collect: Callable[[], None]):
+        self.collectors.append(collect)
+
+    def count_query(self, *_):
+        self.queries += 1
+        stats = current_update.get()
+        if stats is not None:
+            stats.queries += 1
+
+    def render(self) -> str:
+        for collect in self.collectors:
+            collect()
+        lines = []
+
+        def counter(name, help_text, values, label_names):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for key, value in sorted(values.items()):
+                labels = _labels(label_names, key) if label_names else ""
+                lines.append(f"{name}{labels} {value}")
+
+        def histogram(name, help_text, values):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for (router, handler), hist in sorted(values.items()):
+                base = {"router": router, "handler": handler}
+                cumulative = 0
+                for bound, count in zip(hist.buckets, hist.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format({**base, 'le': _number(bound)})} {cumulative}")
+                lines.append(f"{name}_bucket{_format({**base, 'le': '+Inf'})} {hist.count}")
+                lines.append(f"{name}_sum{_format(base)} {_number(hist.sum)}")
+                lines.append(f"{name}_count{_format(base)} {hist.count}")
+
+        counter("woxl_updates_total", "Updates received by type.", self.updates, ("type",))
+        histogram("woxl_handler_duration_seconds", "Time to handle one update, by handler, without the queue wait.",
+                  self.handler_seconds)
+        histogram("woxl_update_queue_wait_seconds", "Time an update waited for its chat and a handler slot.",
+                  self.queue_seconds)
+        histogram("woxl_handler_db_queries", "SQL statements executed while handling one update.",
+                  self.handler_queries)
+        counter("woxl_handler_api_calls_total", "Bot API requests made on behalf of a handler.",
+                self.handler_api_calls, ("router", "handler"))
+        counter("woxl_api_requests_total", "Bot API requests by method.", self.api_requests, ("method",))
+        counter("woxl_api_errors_total", "Failed Bot API requests by method.", self.api_errors, ("method",))
+        lines.append("# HELP woxl_db_queries_total SQL statements executed.")
+        lines.append("# TYPE woxl_db_queries_total counter")
+        lines.append(f"woxl_db_queries_total {self.queries}")
+        for name, (help_text, label_names, values) in sorted(self.counters.items()):
+            counter(name, help_text, values, label_names)
+        for name, (help_text, value) in sorted(self.gauges.items()):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _number(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format(labels: dict) -> str:
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _labels(names, key) -> str:
+    if not isinstance(key, tuple):
+        key = (key,)
+    return _format(dict(zip(names, key)))
+
+
+metrics = Metrics()
+
+
+def instrument_engine(engine):
+    event.listen(engine.sync_engine, "before_cursor_execute", metrics.count_query)
+
+
+async def start_metrics_server() -> web.AppRunner:
+    async def handle(request):
+        return web.Response(text=metrics.render(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, cfg.METRICS_HOST, cfg.METRICS_PORT).start()
+    logger.info("Metrics on http://%s:%s/metrics", cfg.METRICS_HOST, cfg.METRICS_PORT)
+    return runner
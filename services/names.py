@@ -0,0 +1,130 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, or_, select
+
+from config import cfg
+from models import Nick
+
+
+class MemberNameCache:
+    """
+    Bounded TTL + LRU cache of Telegram display names keyed by (chat_id, user_id).
+    Filled from incoming updates, so most lookups never reach get_chat_member.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Tuple[int, int], Tuple[str, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, chat_id: int, user_id: int) -> Optional[str]:
+        key = (chat_id, user_id)
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        name, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return name
+
+    def put(self, chat_id: int, user_id: int, name: str):
+        key = (chat_id, user_id)
+        self._data[key] = (name, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, chat_id: int, user_id: int):
+        self._data.pop((chat_id, user_id), None)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+member_names = MemberNameCache(cfg.NAME_CACHE_SIZE, cfg.NAME_CACHE_TTL)
+
+# Limits how many get_chat_member calls one batch may run at the same time
+_member_lookups = asyncio.Semaphore(cfg.NAME_LOOKUP_CONCURRENCY)
+
+
+def user_link(user_id: int, display: str) -> str:
+    return f'<a href="tg://user?id={user_id}">{display}</a>'
+
+
+def user_links(chat_id: int, user_ids: List[int], names: Dict[Tuple[int, int], str], limit: int = 30) -> str:
+    """Comma separated links for a summary reply; past `limit` users only the remainder is counted."""
+    text = ", ".join(user_link(user_id, names[(chat_id, user_id)]) for user_id in user_ids[:limit])
+    if len(user_ids) > limit:
+        text += f" и ещё {len(user_ids) - limit}"
+    return text
+
+
+async def get_member_name(bot, chat_id: int, user_id: int) -> Optional[str]:
+    """Telegram full name of a chat member, served from member_names when possible."""
+    name = member_names.get(chat_id, user_id)
+    if name is not None:
+        return name
+    async with _member_lookups:
+        try:
+            member = await bot.get_chat_member(chat_id, user_id)
+        except Exception:
+            return None
+    name = member.user.full_name
+    member_names.put(chat_id, user_id, name)
+    return name
+
+
+async def resolve_display_names(pairs: Iterable[Tuple[int, int]], bot, session) -> Dict[Tuple[int, int], str]:
+    """
+    Resolve display names for many (chat_id, user_id) pairs at once:
+    - stored Nicks are fetched with a single query (user_id IN (...) per chat)
+    - the rest are looked up via get_chat_member concurrently
+    """
+    pairs = set(pairs)
+    if not pairs:
+        return {}
+
+    users_by_chat = {}
+    for chat_id, user_id in pairs:
+        users_by_chat.setdefault(chat_id, set()).add(user_id)
+    # chat_id = ? AND user_id IN (...) per chat, so uq_nicks_chat_user is used
+    q = await session.execute(
+        select(Nick.chat_id, Nick.user_id, Nick.nick)
+        .where(or_(*(and_(Nick.chat_id == chat_id, Nick.user_id.in_(users)) for chat_id, users in users_by_chat.items())))
+    )
+    names = {(chat_id, user_id): nick for chat_id, user_id, nick in q.all()}
+
+    missing = [p for p in pairs if p not in names]
+    if missing:
+        fetched = await asyncio.gather(*(get_member_name(bot, chat_id, user_id) for chat_id, user_id in missing))
+        for (chat_id, user_id), name in zip(missing, fetched):
+            names[(chat_id, user_id)] = name or str(user_id)
+    return names
+
+
+async def format_user_link(chat_id: int, user_id: int, bot, session):
+    """
+    Return HTML link with displayed name:
+    - prefer stored Nick in DB
+    - else use Telegram full name from get_chat_member
+    """
+    names = await resolve_display_names([(chat_id, user_id)], bot, session)
+    # Escape is not done here; we rely on simple names. For safety you can html-escape if needed.
+    return user_link(user_id, names[(chat_id, user_id)])
@@ -0,0 +1,183 @@
+"""
+Outbound Bot API scheduler.
+
+Handlers submit prepared methods (message.reply(...), query.message.edit_text(...),
+SendMessage(...).as_(bot)) instead of awaiting them. Every chat has its own FIFO
+drained by one worker task; sends pass a per-chat and a global token bucket,
+TelegramRetryAfter is retried after the requested pause, and an edit of a message
+that is still waiting in the queue simply replaces the older pending edit.
+"""
+import asyncio
+import contextvars
+import logging
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import EditMessageText, TelegramMethod
+
+from config import cfg
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Reservation based token bucket: reserve() takes a token and says how long to wait for it."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self) -> float:
+        self._refill(time.monotonic())
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+    def is_full(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+class _Job:
+    __slots__ = ("method", "future", "edit_key", "context")
+
+    def __init__(self, method: TelegramMethod, future: asyncio.Future, edit_key: Optional[Tuple[int, int]]):
+        self.method = method
+        self.future = future
+        self.edit_key = edit_key
+        # the submitter's context, so the send is attributed to its update (see services/metrics.py)
+        self.context = contextvars.copy_context()
+
+
+def _log_failure(future: asyncio.Future):
+    if future.cancelled():
+        return
+    e = future.exception()
+    if e is not None:
+        logger.warning("Outbound request failed: %s", e)
+
+
+class Outbox:
+    def __init__(self, global_rate: float, chat_rate: float, chat_burst: float, max_retries: int):
+        self._global = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._buckets: Dict[Optional[int], TokenBucket] = {}
+        self._queues: Dict[Optional[int], Deque[_Job]] = {}
+        self._workers: Dict[Optional[int], asyncio.Task] = {}
+        self._pending_edits: Dict[Tuple[int, int], _Job] = {}
+        self.sent = 0
+        self.retried = 0
+        self.coalesced = 0
+
+    def submit(self, method: TelegramMethod) -> asyncio.Future:
+        """
+        Queue a bound Bot API method. Returns a future with the API result;
+        awaiting it is optional, failures are logged either way.
+        """
+        chat_id = getattr(method, "chat_id", None)
+        edit_key = None
+        if isinstance(method, EditMessageText) and method.message_id:
+            edit_key = (chat_id, method.message_id)
+            pending = self._pending_edits.get(edit_key)
+            if pending is not None:
+                # the older text was never sent -- only the newest one matters
+                pending.method = method
+                self.coalesced += 1
+                return pending.future
+
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_log_failure)
+        job = _Job(method, future, edit_key)
+        if edit_key is not None:
+            self._pending_edits[edit_key] = job
+        self._queues.setdefault(chat_id, deque()).append(job)
+        if chat_id not in self._workers:
+            self._workers[chat_id] = asyncio.create_task(self._drain(chat_id))
+        return future
+
+    async def _drain(self, chat_id: Optional[int]):
+        queue = self._queues[chat_id]
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        try:
+            while queue:
+                job = queue.popleft()
+                if job.edit_key is not None:
+                    self._pending_edits.pop(job.edit_key, None)
+                await asyncio.create_task(self._send(bucket, job), context=job.context)
+        finally:
+            del self._queues[chat_id]
+            del self._workers[chat_id]
+            if bucket.is_full():
+                self._buckets.pop(chat_id, None)
+
+    async def _send(self, bucket: TokenBucket, job: _Job):
+        future = job.future
+        for attempt in range(self.max_retries + 1):
+            delay = max(bucket.reserve(), self._global.reserve())
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if future.done():
+                # the submitter gave up waiting
+                return
+            try:
+                result = await job.method
+            except TelegramRetryAfter as e:
+                if attempt == self.max_retries:
+                    if not future.done():
+                        future.set_exception(e)
+                    return
+                self.retried += 1
+                logger.warning("Flood limit hit, retrying %s in %ss", type(job.method).__name__, e.retry_after)
+                await asyncio.sleep(e.retry_after)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                return
+            else:
+                self.sent += 1
+                if not future.done():
+                    future.set_result(result)
+                return
+
+    async def join(self):
+        """Wait until everything submitted so far has been sent."""
+        while self._workers:
+            await asyncio.gather(*list(self._workers.values()), return_exceptions=True)
+
+    async def close(self, timeout: float = 10):
+        try:
+            await asyncio.wait_for(self.join(), timeout)
+        except asyncio.TimeoutError:
+            for task in list(self._workers.values()):
+                task.cancel()
+            logger.warning("Outbox closed with unsent messages")
+
+    def stats(self) -> dict:
+        return {
+            "queued": sum(len(q) for q in self._queues.values()),
+            "active_chats": len(self._workers),
+            "sent": self.sent,
+            "retried": self.retried,
+            "coalesced": self.coalesced,
+        }
+
+
+outbox = Outbox(
+    global_rate=cfg.OUTBOX_GLOBAL_RATE,
+    chat_rate=cfg.OUTBOX_CHAT_RATE,
+    chat_burst=cfg.OUTBOX_CHAT_BURST,
+    max_retries=cfg.OUTBOX_MAX_RETRIES,
+)
@@ -0,0 +1,89 @@
+"""
+Recent message authors per chat, for bulk commands aimed at "everyone who
+wrote since this message".
+
+The Bot API can't look messages up by id, so the bot remembers who wrote the
+last `per_chat` messages of each chat itself (MemberNamesMiddleware records
+every message it sees). Each chat is a ring of (message_id, user_id) in one
+int64 array; chats that went quiet the longest are forgotten first.
+"""
+from array import array
+from collections import OrderedDict
+from typing import List, Tuple
+
+from aiogram.types import Message
+
+from config import cfg
+
+
+class _Ring:
+    __slots__ = ("data", "head", "count")
+
+    def __init__(self, size: int):
+        # message_id, user_id pairs
+        self.data = array("q", bytes(16 * size))
+        self.head = 0
+        self.count = 0
+
+
+class RecentAuthors:
+    def __init__(self, per_chat: int, max_chats: int):
+        self.per_chat = per_chat
+        self.max_chats = max_chats
+        self._chats: "OrderedDict[int, _Ring]" = OrderedDict()
+
+    def record(self, chat_id: int, message_id: int, user_id: int):
+        ring = self._chats.get(chat_id)
+        if ring is None:
+            ring = self._chats[chat_id] = _Ring(self.per_chat)
+            if len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        i = ring.head * 2
+        ring.data[i] = message_id
+        ring.data[i + 1] = user_id
+        ring.head = (ring.head + 1) % self.per_chat
+        ring.count = min(ring.count + 1, self.per_chat)
+
+    def authors_between(self, chat_id: int, first_id: int, last_id: int) -> List[int]:
+        """Distinct authors of the remembered messages with first_id <= message_id < last_id, oldest first."""
+        ring = self._chats.get(chat_id)
+        if ring is None:
+            return []
+        data = ring.data
+        start = (ring.head - ring.count) % self.per_chat
+        authors = {}
+        for k in range(ring.count):
+            i = (start + k) % self.per_chat * 2
+            if first_id <= data[i] < last_id:
+                authors.setdefault(data[i + 1], None)
+        return list(authors)
+
+
+recent_authors = RecentAuthors(cfg.RECENT_MESSAGES_PER_CHAT, cfg.RECENT_CHATS)
+
+
+def bulk_targets(message: Message, args: List[str], limit: int) -> Tuple[List[int], List[str], bool]:
+    """
+    Targets of a bulk command: the user ids leading `args`, or, when there are
+    none and the command replies to a message, every remembered author from
+    that message up to the command. Returns (user_ids, remaining args,
+    from_range); the caller, this bot and other bots are never targets and
+    at most `limit` are returned.
+    """
+    ids = []
+    rest = list(args)
+    while rest and rest[0].isdigit():
+        ids.append(int(rest.pop(0)))
+    from_range = False
+    reply = message.reply_to_message
+    if not ids and reply is not None:
+        if reply.from_user is not None and not reply.from_user.is_bot:
+            # known even if the message is older than what the ring remembers
+            ids.append(reply.from_user.id)
+        ids += recent_authors.authors_between(message.chat.id, reply.message_id, message.message_id)
+        from_range = True
+    excluded = {message.from_user.id, message.bot.id}
+    targets = dict.fromkeys(user_id for user_id in ids if user_id not in excluded)
+    return list(targets)[:limit], rest, from_range
@@ -0,0 +1,62 @@
+import asyncio
+from typing import Dict, Optional
+
+from sqlalchemy import select
+
+from db import AsyncSessionLocal
+from models import RoleAssignment
+
+
+class RoleIndex:
+    """
+    In-memory view of role_assignments, one dict {user_id: role_id} per chat.
+    A chat is loaded with a single query on first use; afterwards every role
+    mutation must be written through with set()/discard() once it is committed.
+    """
+
+    def __init__(self):
+        self._chats: Dict[int, Dict[int, int]] = {}
+        self._loading: Dict[int, asyncio.Lock] = {}
+
+    async def _load(self, chat_id: int) -> Dict[int, int]:
+        lock = self._loading.setdefault(chat_id, asyncio.Lock())
+        async with lock:
+            roles = self._chats.get(chat_id)
+            if roles is None:
+                async with AsyncSessionLocal() as session:
+                    q = await session.execute(
+                        select(RoleAssignment.user_id, RoleAssignment.role_id).where(RoleAssignment.chat_id == chat_id))
+                    roles = dict(q.all())
+                self._chats[chat_id] = roles
+        self._loading.pop(chat_id, None)
+        return roles
+
+    async def roles(self, chat_id: int) -> Dict[int, int]:
+        roles = self._chats.get(chat_id)
+        if roles is None:
+            roles = await self._load(chat_id)
+        return roles
+
+    async def role_of(self, chat_id: int, user_id: int) -> Optional[int]:
+        roles = self._chats.get(chat_id)
+        if roles is None:
+            roles = await self._load(chat_id)
+        return roles.get(user_id)
+
+    def cached(self, chat_id: int) -> Optional[Dict[int, int]]:
+        """Roles of the chat if it is loaded, without touching the database."""
+        return self._chats.get(chat_id)
+
+    def set(self, chat_id: int, user_id: int, role_id: int):
+        # Chats that are not loaded yet will read the committed row on first use
+        roles = self._chats.get(chat_id)
+        if roles is not None:
+            roles[user_id] = role_id
+
+    def discard(self, chat_id: int, user_id: int):
+        roles = self._chats.get(chat_id)
+        if roles is not None:
+            roles.pop(user_id, None)
+
+
+role_index = RoleIndex()
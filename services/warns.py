@@ -0,0 +1,59 @@
+from datetime import datetime
+from typing import List, Optional, Set
+
+from sqlalchemy import desc, insert, select, update
+
+from models import Warn
+from services.chats import chat_registry
+from services.expiry import warn_expiry
+from services.writebuffer import warn_writes
+
+
+async def issue_warn(chat_id: int, user_id: int, issued_by: Optional[int], reason: Optional[str],
+                     until: Optional[datetime]):
+    """
+    Store one warn: make sure the chat row exists, queue the insert for the
+    next group commit and, for a timed warn, register its deadline with the
+    expiry scheduler. Returns once the row is durable. issued_by=None is
+    shown as "Система" in the warns list.
+    """
+    await chat_registry.ensure(chat_id)
+    await warn_writes.add_warn(chat_id, user_id, issued_by, reason, until)
+    if until:
+        warn_expiry.schedule(until)
+
+
+async def issue_warns(session, chat_id: int, user_ids: List[int], issued_by: Optional[int],
+                      reason: Optional[str], until: Optional[datetime]):
+    """Bulk issue_warn: every row in one INSERT and one transaction on the caller's session."""
+    await chat_registry.ensure(chat_id)
+    await session.execute(insert(Warn), [
+        {"chat_id": chat_id, "user_id": user_id, "issued_by": issued_by, "reason": reason, "until": until}
+        for user_id in user_ids
+    ])
+    await session.commit()
+    if until:
+        warn_expiry.schedule(until)
+
+
+async def deactivate_latest_warns(session, chat_id: int, user_ids: List[int]) -> Set[int]:
+    """
+    Bulk warn_writes.deactivate_latest: the newest active warn of each user
+    is deactivated in one transaction. Returns the users that had one.
+    """
+    # one indexed LIMIT 1 lookup per user, the same shape warn_writes uses for a single -пред
+    newest = [
+        select(Warn.id)
+        .where(Warn.chat_id == chat_id, Warn.user_id == user_id, Warn.active == True)
+        .order_by(desc(Warn.created_at), desc(Warn.id))
+        .limit(1)
+        .scalar_subquery()
+        for user_id in user_ids
+    ]
+    rows = (await session.execute(select(Warn.id, Warn.user_id).where(Warn.id.in_(newest)))).all()
+    if rows:
+        await session.execute(
+            update(Warn).where(Warn.id.in_([warn_id for warn_id, _ in rows])).values(active=False)
+            .execution_options(synchronize_session=False))
+    await session.commit()
+    return {user_id for _, user_id in rows}
@@ -0,0 +1,145 @@
+"""
+Group commit for warn writes.
+
+cmd_warn/cmd_unwarn queue their write and await a future instead of opening
+a session and committing themselves. A background task collects the queue
+for a few milliseconds (or until it holds max_batch writes) and applies it
+in one transaction, so a burst of warns costs one commit instead of one per
+command. Futures resolve only after that commit, so an acknowledged write is
+durable; if the transaction fails every write in it gets the exception.
+"""
+import asyncio
+import contextvars
+import logging
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import desc, insert, select, update
+
+from config import cfg
+from db import AsyncSessionLocal
+from models import Warn
+
+logger = logging.getLogger(__name__)
+
+_INSERT = "insert"
+_DEACTIVATE = "deactivate"
+
+
+class WarnWriteBuffer:
+    def __init__(self, max_delay: float, max_batch: int):
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self._pending: List[Tuple[str, dict, asyncio.Future]] = []
+        self._has_items = asyncio.Event()
+        self._full = asyncio.Event()
+        self._closing = False
+        self._task: Optional[asyncio.Task] = None
+        self.flushes = 0
+        self.writes = 0
+
+    def _submit(self, kind: str, payload: dict) -> asyncio.Future:
+        if self._closing:
+            raise RuntimeError("warn write buffer is closed")
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((kind, payload, future))
+        self._has_items.set()
+        if len(self._pending) >= self.max_batch:
+            self._full.set()
+        if self._task is None:
+            # fresh context: a flush serves many updates, not the one that happened to start the task
+            self._task = asyncio.create_task(self._run(), context=contextvars.Context())
+        return future
+
+    def add_warn(self, chat_id: int, user_id: int, issued_by: int, reason: Optional[str],
+                 until: Optional[datetime]) -> asyncio.Future:
+        """Queue a new active warn; the future resolves to None once it is committed."""
+        return self._submit(_INSERT, {
+            "chat_id": chat_id, "user_id": user_id, "issued_by": issued_by,
+            "reason": reason, "until": until, "active": True,
+        })
+
+    def deactivate_latest(self, chat_id: int, user_id: int) -> asyncio.Future:
+        """Queue removal of the user's newest active warn; resolves to False if there was none."""
+        return self._submit(_DEACTIVATE, {"chat_id": chat_id, "user_id": user_id})
+
+    async def _apply(self, session, batch):
+        results = []
+        rows = []
+
+        async def insert_rows():
+            if rows:
+                await session.execute(insert(Warn), rows)
+                results.extend([None] * len(rows))
+                rows.clear()
+
+        for kind, payload, _ in batch:
+            if kind == _INSERT:
+                rows.append(payload)
+                continue
+            # Inserts queued before this removal must be visible to it
+            await insert_rows()
+            latest = (
+                select(Warn.id)
+                .where(Warn.chat_id == payload["chat_id"], Warn.user_id == payload["user_id"], Warn.active == True)
+                .order_by(desc(Warn.created_at), desc(Warn.id))
+                .limit(1)
+                .scalar_subquery()
+            )
+            result = await session.execute(
+                update(Warn).where(Warn.id == latest).values(active=False)
+                .execution_options(synchronize_session=False))
+            results.append(result.rowcount > 0)
+        await insert_rows()
+        return results
+
+    async def flush(self):
+        batch = self._pending[:self.max_batch]
+        del self._pending[:self.max_batch]
+        if not self._pending:
+            self._has_items.clear()
+        if len(self._pending) < self.max_batch:
+            self._full.clear()
+        if not batch:
+            return
+
+        try:
+            async with AsyncSessionLocal() as session:
+                results = await self._apply(session, batch)
+                await session.commit()
+        except Exception as e:
+            logger.exception("Could not flush %s warn writes: %s", len(batch), e)
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.flushes += 1
+        self.writes += len(batch)
+        for (_, _, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def _run(self):
+        while self._pending or not self._closing:
+            await self._has_items.wait()
+            if not self._closing and len(self._pending) < self.max_batch:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.max_delay)
+                except asyncio.TimeoutError:
+                    pass
+            await self.flush()
+
+    async def close(self):
+        """Flush everything still queued and stop the background task."""
+        self._closing = True
+        self._has_items.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+
+    def stats(self) -> dict:
+        return {"queued": len(self._pending), "flushes": self.flushes, "writes": self.writes}
+
+
+warn_writes = WarnWriteBuffer(cfg.WARN_FLUSH_INTERVAL_MS / 1000, cfg.WARN_FLUSH_MAX_BATCH)
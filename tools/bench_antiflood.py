@@ -0,0 +1,123 @@
+"""
+Per-message cost of the anti-flood detector.
+
+    python tools/bench_antiflood.py [--messages 1000000] [--users 20000] [--chats 200] [--limit 10]
+
+Three runs over the same synthetic stream (message times are spread so that
+users post every few seconds and a share of them bursts):
+  hit        FloodDetector.hit with every user fitting into the table
+  evicting   the same with a table a quarter of the users' size (LRU churn)
+  middleware AntiFloodMiddleware.__call__ on prebuilt Updates, warns not written
+Prints µs/message, messages/second and the memory held per tracked user.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+os.environ.setdefault("BOT_TOKEN", "0:bench-antiflood")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram.types import Update  # noqa: E402
+
+from middlewares.antiflood import AntiFloodMiddleware  # noqa: E402
+from services.antiflood import AntiFlood, FloodDetector  # noqa: E402
+
+WINDOW = 5.0
+
+
+def _stream(args, rng):
+    """(chat_id, user_id, t) with a simulated clock; one user in 50 sends bursts."""
+    events = []
+    t = 0.0
+    step = 1.0 / 10000  # 10k msgs/s of simulated traffic
+    for _ in range(args.messages):
+        user = rng.randrange(args.users)
+        chat = -1000000000000 - user % args.chats
+        events.append((chat, user + 1, t))
+        if user % 50 == 0:
+            # the burster posts again right away
+            for _ in range(3):
+                events.append((chat, user + 1, t))
+        t += step
+    return events[:args.messages]
+
+
+def _run_hits(detector, events):
+    hit = detector.hit
+    floods = 0
+    started = time.perf_counter()
+    for chat, user, t in events:
+        if hit(chat, user, t):
+            floods += 1
+    return time.perf_counter() - started, floods
+
+
+class _CountingAntiFlood(AntiFlood):
+    async def _warn(self, message):
+        pass
+
+
+async def _run_middleware(args, events):
+    antiflood = _CountingAntiFlood(args.limit, WINDOW, args.users, "")
+    middleware = AntiFloodMiddleware(antiflood)
+    updates = []
+    for i, (chat, user, _) in enumerate(events[:args.middleware_messages]):
+        updates.append(Update.model_validate({"update_id": i, "message": {
+            "message_id": i, "date": 0, "chat": {"id": chat, "type": "supergroup"},
+            "from": {"id": user, "is_bot": False, "first_name": f"U{user}"}, "text": "привет",
+        }}))
+
+    async def handler(event, data):
+        return None
+
+    started = time.perf_counter()
+    for update in updates:
+        await middleware(handler, update, {})
+    elapsed = time.perf_counter() - started
+    await antiflood.close()
+    return elapsed, len(updates), antiflood.floods
+
+
+def _report(name, elapsed, count, floods):
+    print(f"{name:<11} {elapsed / count * 1e6:7.3f} µs/msg  {count / elapsed:12,.0f} msg/s  floods: {floods}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=1000000)
+    parser.add_argument("--middleware-messages", type=int, default=100000)
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    events = _stream(args, random.Random(args.seed))
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    detector = FloodDetector(args.limit, WINDOW, args.users)
+    elapsed, floods = _run_hits(detector, events)
+    held = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    # tracemalloc slows allocation-heavy code; time the hot loop again without it
+    elapsed, floods = _run_hits(FloodDetector(args.limit, WINDOW, args.users), events)
+    _report("hit", elapsed, len(events), floods)
+
+    evicting = FloodDetector(args.limit, WINDOW, max(args.users // 4, 1))
+    elapsed, floods = _run_hits(evicting, events)
+    _report("evicting", elapsed, len(events), floods)
+    print(f"{'':<11} {evicting.evicted:,} evictions")
+
+    elapsed, count, floods = asyncio.run(_run_middleware(args, events))
+    _report("middleware", elapsed, count, floods)
+
+    print(f"\nmemory: {held / len(detector):.0f} bytes per tracked user ({len(detector):,} users, limit {args.limit})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Compare database throughput of the default engine against the tuned profile
+from db.build_engine on a scratch SQLite file.
+
+    python tools/bench_db.py [--commands 2000] [--concurrency 32]
+
+Each "command" mirrors a warn: a role check, a warn insert + commit and a
+count of the target's active warns, run by many concurrent tasks the way
+handlers run under load.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+_db_dir = tempfile.mkdtemp(prefix="woxl-bench-db-")
+os.environ.setdefault("BOT_TOKEN", "0:bench-db")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import func, select  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from db import Base, build_engine  # noqa: E402
+from models import Chat, RoleAssignment, Warn  # noqa: E402
+
+CHAT_ID = -100123
+
+
+async def _command(Session, i: int) -> bool:
+    try:
+        async with Session() as session:
+            await session.execute(
+                select(RoleAssignment.role_id).where(RoleAssignment.chat_id == CHAT_ID, RoleAssignment.user_id == 1)
+            )
+            target = 1000 + i % 50
+            session.add(Warn(
+                chat_id=CHAT_ID, user_id=target, issued_by=1, reason="bench",
+                until=datetime.now() + timedelta(days=1), active=True,
+            ))
+            await session.commit()
+            await session.execute(
+                select(func.count(Warn.id)).where(Warn.chat_id == CHAT_ID, Warn.user_id == target, Warn.active == True)
+            )
+        return True
+    except OperationalError:
+        return False
+
+
+async def run_profile(name: str, engine, commands: int, concurrency: int) -> dict:
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    Session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    async with Session() as session:
+        session.add(Chat(id=CHAT_ID))
+        await session.flush()
+        session.add(RoleAssignment(chat_id=CHAT_ID, user_id=1, role_id=5))
+        await session.commit()
+
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with sem:
+            return await _command(Session, i)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(one(i) for i in range(commands)))
+    elapsed = time.perf_counter() - started
+    await engine.dispose()
+    ok = sum(results)
+    return {
+        "profile": name,
+        "commands": commands,
+        "failed": commands - ok,
+        "seconds": round(elapsed, 3),
+        "commands_per_sec": round(ok / elapsed, 1),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--commands", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+
+    default_url = f"sqlite+aiosqlite:///{os.path.join(_db_dir, 'default.db')}"
+    tuned_url = f"sqlite+aiosqlite:///{os.path.join(_db_dir, 'tuned.db')}"
+    results = [
+        await run_profile("default", create_async_engine(default_url), args.commands, args.concurrency),
+        await run_profile("tuned", build_engine(tuned_url), args.commands, args.concurrency),
+    ]
+    for r in results:
+        print(f"{r['profile']:>8}: {r['commands_per_sec']:>8} cmd/s  "
+              f"{r['seconds']}s  failed={r['failed']}/{r['commands']}")
+    base, tuned = results
+    if base["commands_per_sec"]:
+        print(f"speedup: {tuned['commands_per_sec'] / base['commands_per_sec']:.2f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
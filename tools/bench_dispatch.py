@@ -0,0 +1,302 @@
+"""
+Replay a synthetic update stream through the real Dispatcher from bot.py and
+measure how fast it is handled.
+
+    python tools/bench_dispatch.py [--chats 50] [--updates 5000] [--concurrency 16] [--raid 0]
+                                   [--out bench_dispatch.json] [--baseline old.json]
+
+The Bot uses a fake session that answers every API method locally and counts
+the calls, so only the bot's own code and the database are measured. The
+stream mixes chatter, +пред / -пред, ?пред and page clicks, админы, +ник and
+role commands across many chats. Results are written as JSON; pass an earlier
+file as --baseline to print the change per metric. With QUERY_WATCH=raise the
+run fails on the first handler that breaks the query budget. --raid N also
+drops N messages (mostly spam, some ?пред) into the first chat all at once,
+the way a raid arrives through polling, and reports what admission control
+did with them.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+_db_dir = tempfile.mkdtemp(prefix="woxl-bench-dispatch-")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(_db_dir, 'dispatch.db')}"
+os.environ.setdefault("BOT_TOKEN", "123456:bench-dispatch")
+# Measure the bot, not Telegram's rate limits
+os.environ.setdefault("OUTBOX_GLOBAL_RATE", "1000000")
+os.environ.setdefault("OUTBOX_CHAT_RATE", "1000000")
+os.environ.setdefault("OUTBOX_CHAT_BURST", "1000000")
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, _ROOT)
+
+from aiogram import Bot  # noqa: E402
+from aiogram.client.session.base import BaseSession  # noqa: E402
+from aiogram.types import ChatMemberMember, ChatMemberOwner, Message, Update  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+
+from bot import admission, dp  # noqa: E402
+from db import engine, init_db  # noqa: E402
+from services.outbox import outbox  # noqa: E402
+from services.writebuffer import warn_writes  # noqa: E402
+
+OWNER_ID = 1
+BOT_ID = 123456
+
+
+class RecordingSession(BaseSession):
+    """Answers Bot API calls locally and counts them per method."""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = Counter()
+        self._message_ids = itertools.count(1_000_000)
+
+    async def make_request(self, bot, method, timeout=None):
+        name = type(method).__name__
+        self.calls[name] += 1
+        if name == "SendMessage":
+            return Message.model_validate({
+                "message_id": next(self._message_ids), "date": int(time.time()),
+                "chat": {"id": method.chat_id, "type": "supergroup"}, "text": method.text,
+            }, context={"bot": bot})
+        if name == "GetChatMember":
+            return ChatMemberMember.model_validate({
+                "status": "member", "user": {"id": method.user_id, "is_bot": False, "first_name": f"U{method.user_id}"},
+            }, context={"bot": bot})
+        if name == "GetChatAdministrators":
+            return [ChatMemberOwner.model_validate({
+                "status": "creator", "is_anonymous": False,
+                "user": {"id": OWNER_ID, "is_bot": False, "first_name": "Owner"},
+            }, context={"bot": bot})]
+        return True
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, *args, **kwargs):
+        yield b""
+
+
+class UpdateFactory:
+    def __init__(self):
+        self._ids = itertools.count(1)
+
+    def _user(self, user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"U{user_id}"}
+
+    def _message(self, chat_id, user_id, text, reply_to=None):
+        m = {"message_id": next(self._ids), "date": int(time.time()),
+             "chat": {"id": chat_id, "type": "supergroup"}, "from": self._user(user_id), "text": text}
+        if reply_to:
+            m["reply_to_message"] = self._message(chat_id, reply_to, "…")
+        return m
+
+    def message(self, chat_id, user_id, text, reply_to=None) -> Update:
+        return Update.model_validate({"update_id": next(self._ids), "message": self._message(chat_id, user_id, text, reply_to)})
+
+    def callback(self, chat_id, user_id, data) -> Update:
+        m = self._message(chat_id, BOT_ID, "⚠️")
+        return Update.model_validate({"update_id": next(self._ids), "callback_query": {
+            "id": str(next(self._ids)), "chat_instance": str(chat_id), "from": self._user(user_id),
+            "message": m, "data": data,
+        }})
+
+    def bot_added(self, chat_id) -> Update:
+        return Update.model_validate({"update_id": next(self._ids), "my_chat_member": {
+            "chat": {"id": chat_id, "type": "supergroup"}, "from": self._user(OWNER_ID), "date": int(time.time()),
+            "old_chat_member": {"status": "left", "user": {"id": BOT_ID, "is_bot": True, "first_name": "Bot"}},
+            "new_chat_member": {"status": "member", "user": {"id": BOT_ID, "is_bot": True, "first_name": "Bot"}},
+        }})
+
+
+# (kind, weight); each kind becomes one update in _make_update
+MIX = [
+    ("chatter", 55),
+    ("warn", 10),
+    ("unwarn", 4),
+    ("warns_list", 6),
+    ("warns_page", 4),
+    ("admins", 5),
+    ("nick", 7),
+    ("role", 9),
+]
+
+
+def _make_update(factory, rng, chat_id, kind):
+    member = rng.randint(2, 200)
+    moderator = rng.randint(2, 6)
+    if kind == "chatter":
+        return factory.message(chat_id, member, rng.choice(("привет", "как дела?", "лол", "кто играет вечером")))
+    if kind == "warn":
+        return factory.message(chat_id, moderator, f"+пред {rng.choice(('1ч', '1д', '30м'))} флуд", reply_to=member)
+    if kind == "unwarn":
+        return factory.message(chat_id, moderator, "-пред", reply_to=member)
+    if kind == "warns_list":
+        return factory.message(chat_id, member, rng.choice(("?пред", "?пред 2")))
+    if kind == "warns_page":
+        return factory.callback(chat_id, member, f"warns:{rng.randint(1, 3)}")
+    if kind == "admins":
+        return factory.message(chat_id, member, "админы")
+    if kind == "nick":
+        return factory.message(chat_id, member, f"+ник Игрок{rng.randint(1, 999)}")
+    command = rng.choice(("+админ", "повысить", "понизить", "-админ"))
+    return factory.message(chat_id, OWNER_ID, command, reply_to=moderator)
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * q))]
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=_ROOT, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+
+async def run(args) -> dict:
+    await init_db()
+    session = RecordingSession()
+    bot = Bot(token=os.environ["BOT_TOKEN"], session=session)
+    factory = UpdateFactory()
+    rng = random.Random(args.seed)
+    chats = [-1000000000000 - i for i in range(args.chats)]
+
+    # Warm-up, not measured: register chats, owner and a few moderators
+    for chat_id in chats:
+        await dp.feed_update(bot, factory.bot_added(chat_id))
+        for moderator in range(2, 7):
+            await dp.feed_update(bot, factory.message(chat_id, OWNER_ID, "+админ", reply_to=moderator))
+    await outbox.join()
+
+    kinds, weights = zip(*MIX)
+    stream = []
+    for _ in range(args.updates):
+        kind = rng.choices(kinds, weights)[0]
+        stream.append((kind, _make_update(factory, rng, rng.choice(chats), kind)))
+
+    queries = 0
+    checkouts = 0
+
+    def _count_query(*_):
+        nonlocal queries
+        queries += 1
+
+    def _count_checkout(*_):
+        nonlocal checkouts
+        checkouts += 1
+
+    session.calls.clear()
+    event.listen(engine.sync_engine, "before_cursor_execute", _count_query)
+    event.listen(engine.sync_engine.pool, "checkout", _count_checkout)
+    latencies = defaultdict(list)
+    sem = asyncio.Semaphore(args.concurrency)
+
+    async def handle(kind, update):
+        async with sem:
+            started = time.perf_counter()
+            await dp.feed_update(bot, update)
+            latencies[kind].append(time.perf_counter() - started)
+
+    async def flood(update):
+        # a raid is not throttled by the reader, every update is in flight at once
+        started = time.perf_counter()
+        await dp.feed_update(bot, update)
+        latencies["raid"].append(time.perf_counter() - started)
+
+    raid = [factory.message(chats[0], rng.randint(1000, 5000), rng.choice(("спам", "спам", "спам", "?пред")))
+            for _ in range(args.raid)]
+    started = time.perf_counter()
+    await asyncio.gather(*(flood(update) for update in raid), *(handle(kind, update) for kind, update in stream))
+    await outbox.join()
+    elapsed = time.perf_counter() - started
+    event.remove(engine.sync_engine, "before_cursor_execute", _count_query)
+    event.remove(engine.sync_engine.pool, "checkout", _count_checkout)
+
+    await warn_writes.close()
+    await outbox.close()
+    await engine.dispose()
+
+    def summary(values):
+        values = sorted(values)
+        return {
+            "count": len(values),
+            "p50_ms": round(_percentile(values, 0.50) * 1000, 3),
+            "p95_ms": round(_percentile(values, 0.95) * 1000, 3),
+            "p99_ms": round(_percentile(values, 0.99) * 1000, 3),
+        }
+
+    everything = [v for values in latencies.values() for v in values]
+    api_calls = sum(session.calls.values())
+    return {
+        "revision": _git_revision(),
+        "params": {"chats": args.chats, "updates": args.updates, "concurrency": args.concurrency, "seed": args.seed},
+        "seconds": round(elapsed, 3),
+        "updates_per_sec": round(args.updates / elapsed, 1),
+        "latency": summary(everything),
+        "db_queries_per_update": round(queries / args.updates, 3),
+        "pool_checkouts_per_update": round(checkouts / args.updates, 3),
+        "api_calls_per_update": round(api_calls / args.updates, 3),
+        "api_calls": dict(session.calls.most_common()),
+        "by_kind": {kind: summary(values) for kind, values in sorted(latencies.items())},
+        "admission": admission.stats(),
+    }
+
+
+def _compare(result, baseline):
+    rows = [
+        ("updates_per_sec", result["updates_per_sec"], baseline["updates_per_sec"]),
+        ("p50_ms", result["latency"]["p50_ms"], baseline["latency"]["p50_ms"]),
+        ("p95_ms", result["latency"]["p95_ms"], baseline["latency"]["p95_ms"]),
+        ("p99_ms", result["latency"]["p99_ms"], baseline["latency"]["p99_ms"]),
+        ("db_queries_per_update", result["db_queries_per_update"], baseline["db_queries_per_update"]),
+        ("pool_checkouts_per_update", result.get("pool_checkouts_per_update", 0),
+         baseline.get("pool_checkouts_per_update", 0)),
+        ("api_calls_per_update", result["api_calls_per_update"], baseline["api_calls_per_update"]),
+    ]
+    print(f"\nvs {baseline.get('revision') or 'baseline'}:")
+    for name, new, old in rows:
+        change = f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+        print(f"  {name:<26} {old:>10} -> {new:<10} {change}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--updates", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--raid", type=int, default=0, help="extra messages flooding one chat")
+    parser.add_argument("--out", default="bench_dispatch.json")
+    parser.add_argument("--baseline", help="earlier result file to compare against")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    result = asyncio.run(run(args))
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(json.dumps({k: result[k] for k in ("updates_per_sec", "latency", "db_queries_per_update",
+                                              "pool_checkouts_per_update", "api_calls_per_update",
+                                              "admission")}, indent=2))
+    print(f"written to {args.out}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            _compare(result, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Burst throughput of warn writes: the old per-command commit (session, commit,
+refresh) against the group-commit buffer used by cmd_warn/cmd_unwarn.
+
+    python tools/bench_warns.py [--warns 2000] [--concurrency 64]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+_db_dir = tempfile.mkdtemp(prefix="woxl-bench-warns-")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(_db_dir, 'warns.db')}"
+os.environ.setdefault("BOT_TOKEN", "0:bench-warns")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import func, select  # noqa: E402
+
+from config import cfg  # noqa: E402
+from db import AsyncSessionLocal, engine, init_db  # noqa: E402
+from models import Chat, Warn  # noqa: E402
+from services.writebuffer import WarnWriteBuffer  # noqa: E402
+
+CHAT_ID = -100123
+
+
+async def _per_command(i):
+    async with AsyncSessionLocal() as session:
+        w = Warn(chat_id=CHAT_ID, user_id=1000 + i % 50, issued_by=1, reason="bench", until=None, active=True)
+        session.add(w)
+        await session.commit()
+        await session.refresh(w)
+
+
+async def _burst(name, write, warns, concurrency) -> dict:
+    sem = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i):
+        async with sem:
+            started = time.perf_counter()
+            await write(i)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(warns)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "mode": name,
+        "warns_per_sec": round(warns / elapsed, 1),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 2),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--warns", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    args = parser.parse_args()
+
+    await init_db()
+    async with AsyncSessionLocal() as session:
+        session.add(Chat(id=CHAT_ID))
+        await session.commit()
+
+    buffer = WarnWriteBuffer(cfg.WARN_FLUSH_INTERVAL_MS / 1000, cfg.WARN_FLUSH_MAX_BATCH)
+
+    async def buffered(i):
+        await buffer.add_warn(CHAT_ID, 1000 + i % 50, 1, "bench", None)
+
+    results = [
+        await _burst("per-command", _per_command, args.warns, args.concurrency),
+        await _burst("group-commit", buffered, args.warns, args.concurrency),
+    ]
+    await buffer.close()
+
+    async with AsyncSessionLocal() as session:
+        stored = await session.scalar(select(func.count()).select_from(Warn))
+    await engine.dispose()
+
+    for r in results:
+        print(f"{r['mode']:>12}: {r['warns_per_sec']:>8} warns/s  p50={r['p50_ms']}ms  p99={r['p99_ms']}ms")
+    print(f"group-commit: {buffer.writes} writes in {buffer.flushes} transactions")
+    print(f"rows stored: {stored} (expected {2 * args.warns})")
+    base, grouped = results
+    print(f"speedup: {grouped['warns_per_sec'] / base['warns_per_sec']:.2f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
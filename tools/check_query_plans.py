@@ -0,0 +1,126 @@
+"""
+Run the bot's hot queries against a scratch SQLite database and check with
+EXPLAIN QUERY PLAN that none of them scans a table or sorts in a temp b-tree.
+
+    python tools/check_query_plans.py
+
+Exits with status 1 and prints the offending plans if any query regresses.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+_db_dir = tempfile.mkdtemp(prefix="woxl-plans-")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(_db_dir, 'plans.db')}"
+os.environ.setdefault("BOT_TOKEN", "0:check-query-plans")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event, select  # noqa: E402
+
+from db import AsyncSessionLocal, engine, init_db  # noqa: E402
+from handlers.warns_handler import render_warns_page  # noqa: E402
+from models import Chat, Nick, RoleAssignment, Warn  # noqa: E402
+from services.chats import ChatRegistry  # noqa: E402
+from services.expiry import WarnExpiryScheduler  # noqa: E402
+from services.names import resolve_display_names  # noqa: E402
+from services.roles import RoleIndex  # noqa: E402
+from services.warns import deactivate_latest_warns  # noqa: E402
+from services.writebuffer import WarnWriteBuffer  # noqa: E402
+from utils import decode_cursor  # noqa: E402
+
+CHAT_ID = -100123
+
+
+async def _seed():
+    async with AsyncSessionLocal() as session:
+        session.add(Chat(id=CHAT_ID))
+        await session.flush()
+        session.add(RoleAssignment(chat_id=CHAT_ID, user_id=1, role_id=5))
+        session.add(Nick(chat_id=CHAT_ID, user_id=2, nick="nick"))
+        now = datetime.utcnow()
+        for i in range(50):
+            session.add(Warn(chat_id=CHAT_ID, user_id=10 + i % 5, issued_by=1, created_at=now - timedelta(minutes=i)))
+        await session.commit()
+
+
+async def _hot_queries():
+    """Exercise the same code paths the handlers use."""
+    await RoleIndex().role_of(CHAT_ID, 1)
+    chats = ChatRegistry()
+    await chats.load()
+    await chats.ensure(CHAT_ID - 1)
+    async with AsyncSessionLocal() as session:
+        await resolve_display_names({(CHAT_ID, 1), (CHAT_ID, 2)}, None, session)
+        await session.execute(select(Nick).where(Nick.chat_id == CHAT_ID, Nick.user_id == 2))
+        await session.execute(
+            select(RoleAssignment).where(RoleAssignment.chat_id == CHAT_ID, RoleAssignment.user_id == 1))
+    cursor = decode_cursor(f"{(datetime.utcnow() - datetime(1970, 1, 1)) // timedelta(microseconds=1)}:25")
+    async with AsyncSessionLocal() as session:
+        for target in (None, 10):
+            await render_warns_page(CHAT_ID, None, session, target, page=2)
+            await render_warns_page(CHAT_ID, None, session, target, page=2, cursor=cursor, direction="n")
+            await render_warns_page(CHAT_ID, None, session, target, page=2, cursor=cursor, direction="p")
+    writes = WarnWriteBuffer(0.001, 100)
+    writes.add_warn(CHAT_ID, 10, 1, None, None)
+    await writes.deactivate_latest(CHAT_ID, 10)
+    await writes.close()
+    async with AsyncSessionLocal() as session:
+        await deactivate_latest_warns(session, CHAT_ID, [11, 12, 13])
+        await session.execute(select(RoleAssignment.user_id).where(
+            RoleAssignment.chat_id == CHAT_ID, RoleAssignment.user_id.in_([1, 2, 3])))
+    expiry = WarnExpiryScheduler()
+    await expiry._rebuild()
+    await expiry.expire_due(datetime.now())
+
+
+def _bad_steps(plan_rows):
+    bad = []
+    for row in plan_rows:
+        detail = row[-1]
+        if detail.startswith("SCAN") and "INDEX" not in detail and "CONSTANT ROW" not in detail:
+            bad.append(detail)
+        elif "TEMP B-TREE" in detail:
+            bad.append(detail)
+    return bad
+
+
+async def main() -> int:
+    await init_db()
+    await _seed()
+
+    captured = []
+
+    def _capture(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith(("SELECT", "INSERT", "UPDATE", "DELETE")):
+            captured.append((statement, parameters))
+
+    event.listen(engine.sync_engine, "before_cursor_execute", _capture)
+    try:
+        await _hot_queries()
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", _capture)
+
+    failures = 0
+    seen = set()
+    async with engine.connect() as conn:
+        for statement, parameters in captured:
+            if statement in seen:
+                continue
+            seen.add(statement)
+            rows = (await conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)).all()
+            bad = _bad_steps(rows)
+            status = "FAIL" if bad else "ok"
+            print(f"[{status}] {' '.join(statement.split())}")
+            for row in rows:
+                print(f"        {row[-1]}")
+            failures += bool(bad)
+    await engine.dispose()
+
+    print(f"\n{len(seen)} queries checked, {failures} without a usable index")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,64 @@
+"""
+POST recorded Telegram updates to a running webhook endpoint.
+
+    python tools/replay_webhook.py updates.jsonl [--url http://127.0.0.1:8080/webhook] [--secret S]
+
+The file holds one update JSON object per line (or a single JSON array).
+Prints every non-200 response and the overall acknowledgement rate.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+from aiohttp import ClientSession
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def load_updates(path):
+    with open(path, encoding="utf-8") as f:
+        text = f.read().strip()
+    if text.startswith("["):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+async def replay(url, secret, updates, concurrency):
+    headers = {SECRET_HEADER: secret} if secret else {}
+    slots = asyncio.Semaphore(concurrency)
+    failures = 0
+
+    async with ClientSession() as session:
+        async def post(update):
+            nonlocal failures
+            async with slots:
+                async with session.post(url, json=update, headers=headers) as resp:
+                    if resp.status != 200:
+                        failures += 1
+                        print(f"update {update.get('update_id')}: HTTP {resp.status} {await resp.text()}")
+
+        started = time.perf_counter()
+        await asyncio.gather(*(post(u) for u in updates))
+        elapsed = time.perf_counter() - started
+
+    print(f"{len(updates)} updates in {elapsed:.3f}s ({len(updates) / elapsed:.0f}/s), {failures} failed")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("file")
+    parser.add_argument("--url", default=f"http://127.0.0.1:{os.getenv('WEBHOOK_PORT', '8080')}{os.getenv('WEBHOOK_PATH', '/webhook')}")
+    parser.add_argument("--secret", default=os.getenv("WEBHOOK_SECRET", ""))
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    failures = asyncio.run(replay(args.url, args.secret, load_updates(args.file), args.concurrency))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
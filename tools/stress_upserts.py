@@ -0,0 +1,113 @@
+"""
+Hammer the create-or-update paths with concurrent writers on the same keys
+and check that no duplicates or integrity errors appear. Lock timeouts
+("database is locked") are reported on their own: they mean writers were
+not serialized, not that an upsert raced.
+
+    python tools/stress_upserts.py [--writers 64] [--rounds 20] [--legacy]
+
+--legacy runs the old SELECT-then-INSERT pattern for comparison.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+
+_db_dir = tempfile.mkdtemp(prefix="woxl-upserts-")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(_db_dir, 'upserts.db')}"
+os.environ.setdefault("BOT_TOKEN", "0:stress-upserts")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import func, select  # noqa: E402
+from sqlalchemy.exc import IntegrityError, OperationalError  # noqa: E402
+
+from db import AsyncSessionLocal, init_db  # noqa: E402
+from models import Chat, Nick, RoleAssignment  # noqa: E402
+from upserts import ensure_chat, upsert_nick, upsert_role  # noqa: E402
+
+CHATS = (-1001, -1002)
+USERS = range(1, 6)
+
+
+async def _upsert_write(chat_id, user_id, n):
+    async with AsyncSessionLocal() as session:
+        await ensure_chat(session, chat_id)
+        await upsert_role(session, chat_id, user_id, 1 + n % 5, assigned_by=n)
+        await upsert_nick(session, chat_id, user_id, f"nick{n}")
+        await session.commit()
+
+
+async def _legacy_write(chat_id, user_id, n):
+    async with AsyncSessionLocal() as session:
+        if not (await session.execute(select(Chat).where(Chat.id == chat_id))).scalars().first():
+            session.add(Chat(id=chat_id))
+            await session.commit()
+        q = await session.execute(select(RoleAssignment).where(RoleAssignment.chat_id == chat_id, RoleAssignment.user_id == user_id))
+        existing = q.scalars().first()
+        if existing:
+            existing.role_id = 1 + n % 5
+        else:
+            session.add(RoleAssignment(chat_id=chat_id, user_id=user_id, role_id=1 + n % 5, assigned_by=n))
+        q = await session.execute(select(Nick).where(Nick.chat_id == chat_id, Nick.user_id == user_id))
+        existing = q.scalars().first()
+        if existing:
+            existing.nick = f"nick{n}"
+        else:
+            session.add(Nick(chat_id=chat_id, user_id=user_id, nick=f"nick{n}"))
+        await session.commit()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--writers", type=int, default=64)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--legacy", action="store_true")
+    args = parser.parse_args()
+    write = _legacy_write if args.legacy else _upsert_write
+
+    await init_db()
+    errors = {"integrity": 0, "locked": 0}
+
+    async def writer(w):
+        for r in range(args.rounds):
+            n = w * args.rounds + r
+            try:
+                await write(CHATS[n % len(CHATS)], USERS[n % len(USERS)], n)
+            except Exception as e:  # noqa: BLE001 -- counted and reported below
+                if isinstance(e, IntegrityError):
+                    key = "integrity"
+                elif isinstance(e, OperationalError) and "locked" in str(e):
+                    key = "locked"
+                else:
+                    key = type(e).__name__
+                errors[key] = errors.get(key, 0) + 1
+
+    await asyncio.gather(*(writer(w) for w in range(args.writers)))
+
+    async with AsyncSessionLocal() as session:
+        counts = {}
+        for model, cols in ((Chat, (Chat.id,)), (RoleAssignment, (RoleAssignment.chat_id, RoleAssignment.user_id)),
+                            (Nick, (Nick.chat_id, Nick.user_id))):
+            dupes = await session.execute(
+                select(func.count()).select_from(
+                    select(*cols).group_by(*cols).having(func.count() > 1).subquery()
+                )
+            )
+            total = await session.scalar(select(func.count()).select_from(model))
+            counts[model.__tablename__] = (total, dupes.scalar())
+
+    mode = "legacy" if args.legacy else "upsert"
+    other = {k: v for k, v in errors.items() if k not in ("integrity", "locked")}
+    print(f"mode={mode} writes={args.writers * args.rounds} integrity_errors={errors['integrity']} "
+          f"lock_errors={errors['locked']} other_errors={other or 0}")
+    for table, (total, dupes) in counts.items():
+        print(f"  {table}: rows={total} duplicated_keys={dupes}")
+    expected = {"chats": len(CHATS), "role_assignments": len(CHATS) * len(USERS), "nicks": len(CHATS) * len(USERS)}
+    ok = not any(errors.values()) and all(counts[t] == (n, 0) for t, n in expected.items())
+    print("OK" if ok else "FAILED")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
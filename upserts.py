@@ -0,0 +1,53 @@
+"""
+Single-statement writes built on INSERT ... ON CONFLICT, for the rows that
+handlers create-or-update: chats, role assignments and nicks.
+
+Each helper only executes the statement; committing is left to the caller.
+"""
+from datetime import datetime
+
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import Chat, Nick, RoleAssignment
+
+_INSERTS = {
+    "sqlite": sqlite.insert,
+    "postgresql": postgresql.insert,
+}
+
+
+def _insert(session, model):
+    dialect = session.get_bind().dialect.name
+    try:
+        return _INSERTS[dialect](model)
+    except KeyError:
+        raise NotImplementedError(f"upserts are not implemented for dialect {dialect!r}") from None
+
+
+async def ensure_chat(session, chat_id: int):
+    """Register a chat; does nothing if it is already known."""
+    stmt = _insert(session, Chat).values(id=chat_id).on_conflict_do_nothing(index_elements=[Chat.id])
+    await session.execute(stmt)
+
+
+async def upsert_role(session, chat_id: int, user_id: int, role_id: int, **fields):
+    """
+    Give user_id role_id in chat_id. Extra columns (assigned_by, reason,
+    assigned_at) are written on insert and overwritten on conflict; columns
+    not passed keep their stored values.
+    """
+    stmt = _insert(session, RoleAssignment).values(chat_id=chat_id, user_id=user_id, role_id=role_id, **fields)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[RoleAssignment.chat_id, RoleAssignment.user_id],
+        set_={"role_id": stmt.excluded.role_id, **{k: stmt.excluded[k] for k in fields}},
+    )
+    await session.execute(stmt)
+
+
+async def upsert_nick(session, chat_id: int, user_id: int, nick: str):
+    stmt = _insert(session, Nick).values(chat_id=chat_id, user_id=user_id, nick=nick, updated_at=datetime.utcnow())
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Nick.chat_id, Nick.user_id],
+        set_={"nick": stmt.excluded.nick, "updated_at": stmt.excluded.updated_at},
+    )
+    await session.execute(stmt)
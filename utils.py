@@ -1,6 +1,6 @@
 import re
-from datetime import datetime
-from typing import Optional, Union
+from datetime import datetime, timedelta
+from typing import Optional, Tuple, Union
 from dateutil.relativedelta import relativedelta
 
 _time_regex = re.compile(r"(?P<num>\d+)\s*(?P<unit>y|g|mon|мес|w|н|d|д|h|ч|m|м|s|с)$", re.IGNORECASE)
@@ -51,4 +51,21 @@ def format_timedelta_remaining(until_dt: datetime) -> str:
     if minutes: parts.append(f"{minutes}м")
     if not parts: parts.append(f"{seconds}с")
 
-    return " ".join(parts)
\ No newline at end of file
+    return " ".join(parts)
+
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    """Compact keyset cursor for callback_data: '<microseconds since epoch>:<id>'."""
+    micros = (created_at - _EPOCH) // timedelta(microseconds=1)
+    return f"{micros}:{row_id}"
+
+
+def decode_cursor(text: str) -> Optional[Tuple[datetime, int]]:
+    try:
+        micros, row_id = text.split(":")
+        return _EPOCH + timedelta(microseconds=int(micros)), int(row_id)
+    except ValueError:
+        return None
@@ -0,0 +1,73 @@
+"""
+Webhook ingestion: an embedded aiohttp server that receives updates from
+Telegram, acknowledges them immediately and runs the handlers in background
+tasks. Concurrency and per-chat ordering are enforced by ChatSchedulerMiddleware.
+"""
+import asyncio
+import logging
+from typing import Any, Dict
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+from aiohttp import web
+
+from config import cfg
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundRequestHandler(SimpleRequestHandler):
+    """
+    SimpleRequestHandler in background mode that drains acknowledged updates
+    on shutdown. The secret token header is checked by the parent. Tasks are
+    created in arrival order, which the dispatcher's scheduler relies on; a
+    semaphore here would let one busy chat hold every slot while it waits for
+    its own earlier updates.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, **kwargs: Any):
+        super().__init__(dispatcher, bot, handle_in_background=True, **kwargs)
+
+    async def _background_feed_update(self, bot: Bot, update: Dict[str, Any]) -> None:
+        try:
+            await super()._background_feed_update(bot, update)
+        except Exception as e:
+            logger.exception("Error while handling webhook update: %s", e)
+
+    async def drain(self):
+        """Wait for updates that were already acknowledged to finish."""
+        if self._background_feed_update_tasks:
+            await asyncio.gather(*self._background_feed_update_tasks, return_exceptions=True)
+
+    async def close(self) -> None:
+        await self.drain()
+        await super().close()
+
+
+def build_webhook_app(dp: Dispatcher, bot: Bot) -> web.Application:
+    app = web.Application()
+    handler = BackgroundRequestHandler(dp, bot, secret_token=cfg.WEBHOOK_SECRET)
+    handler.register(app, path=cfg.WEBHOOK_PATH)
+    return app
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    app = build_webhook_app(dp, bot)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, cfg.WEBHOOK_HOST, cfg.WEBHOOK_PORT)
+    await site.start()
+    logger.info("Webhook server listening on %s:%s%s", cfg.WEBHOOK_HOST, cfg.WEBHOOK_PORT, cfg.WEBHOOK_PATH)
+
+    if cfg.WEBHOOK_URL:
+        await bot.set_webhook(
+            cfg.WEBHOOK_URL,
+            secret_token=cfg.WEBHOOK_SECRET,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        # on_shutdown drains in-flight updates and closes the bot session
+        await runner.cleanup()
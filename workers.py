@@ -0,0 +1,287 @@
+"""
+Chat-partitioned worker processes (WORKERS > 1).
+
+One ingestion process receives updates (long polling or the webhook server)
+and routes every raw update to worker `chat_id % WORKERS` over a local
+multiprocessing queue. Each worker is a separate interpreter with its own
+Dispatcher, engine, caches and outbox. Inside a worker updates are fed in
+queue order and the dispatcher's ChatSchedulerMiddleware handles one chat's
+updates strictly in order while different chats run concurrently.
+
+Shutdown: the ingestion process stops receiving, puts a sentinel into every
+queue and waits for the workers, which finish everything already queued and
+flush their buffers before exiting.
+"""
+import asyncio
+import hmac
+import importlib
+import logging
+import multiprocessing
+import os
+import signal
+from typing import Any, Dict, List, Optional, Set
+
+from aiogram import Bot, Dispatcher
+from aiohttp import web
+
+from config import cfg
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait for a worker to drain before it is terminated
+SHUTDOWN_TIMEOUT = 30
+_STOP = None
+# Long-poll timeout for getUpdates and the retry backoff after a failed call, seconds
+POLL_TIMEOUT = 30
+POLL_RETRY_MIN = 1.0
+POLL_RETRY_MAX = 60.0
+
+
+def chat_key(update: Dict[str, Any]) -> int:
+    """Chat id of a raw update (user id for chatless updates, 0 if there is neither)."""
+    for name, payload in update.items():
+        if not isinstance(payload, dict):
+            continue
+        chat = payload.get("chat")
+        if chat is None and isinstance(payload.get("message"), dict):
+            # callback_query
+            chat = payload["message"].get("chat")
+        if chat is not None:
+            return chat["id"]
+        user = payload.get("from") or payload.get("user")
+        if user is not None:
+            return user["id"]
+    return 0
+
+
+# --- worker side ---
+
+class UpdateFeeder:
+    """
+    Feeds raw updates into the dispatcher, one task each, in queue order.
+    Per-chat ordering and the concurrency cap come from ChatSchedulerMiddleware.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot):
+        self.dp = dp
+        self.bot = bot
+        self._tasks: Set[asyncio.Task] = set()
+
+    def put(self, update: Dict[str, Any]):
+        task = asyncio.create_task(self._feed(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _feed(self, update: Dict[str, Any]):
+        try:
+            await self.dp.feed_raw_update(self.bot, update)
+        except Exception as e:
+            logger.exception("Error while handling update %s: %s", update.get("update_id"), e)
+
+    async def join(self):
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+
+def _app_module():
+    """
+    Module that defines the Dispatcher. When started as `python bot.py`, spawn has
+    already re-run bot.py as __main__ in this process; importing `bot` again would
+    attach the same routers to a second Dispatcher.
+    """
+    import __main__
+    if hasattr(__main__, "dp") and hasattr(__main__, "bot"):
+        return __main__
+    return importlib.import_module("bot")
+
+
+async def _serve_worker(index: int, inbox: multiprocessing.Queue):
+    # Imported here: each worker builds its own Dispatcher, engine and caches
+    app = _app_module()
+    bot, dp = app.bot, app.dp
+    from db import engine
+    from services.adminsync import admin_sync
+    from services.antiflood import antiflood
+    from services.chats import chat_registry
+    from services.expiry import warn_expiry
+    from services.metrics import start_metrics_server
+    from services.outbox import outbox
+    from services.writebuffer import warn_writes
+
+    await chat_registry.load()
+    # warns of a chat are issued by the worker that serves it, so that worker expires them
+    warn_expiry.start(partition=(index, cfg.WORKERS))
+    # each worker syncs owners of its own chats, so its role cache stays coherent
+    admin_sync.start(bot, partition=(index, cfg.WORKERS))
+    metrics_runner = await start_metrics_server() if cfg.METRICS_PORT else None
+    feeder = UpdateFeeder(dp, bot)
+    loop = asyncio.get_running_loop()
+    logger.info("Worker %s (pid %s) started", index, os.getpid())
+
+    try:
+        while True:
+            update = await loop.run_in_executor(None, inbox.get)
+            if update is _STOP:
+                break
+            feeder.put(update)
+        await feeder.join()
+    finally:
+        await warn_expiry.stop()
+        await admin_sync.stop()
+        if antiflood is not None:
+            await antiflood.close()
+        await warn_writes.close()
+        await outbox.close()
+        await bot.session.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await engine.dispose()
+        logger.info("Worker %s stopped", index)
+
+
+def _worker_main(index: int, inbox: multiprocessing.Queue):
+    # Ctrl+C and systemd's stop (SIGTERM to the whole control group) reach the workers too;
+    # shutdown is driven by the ingestion process, so queues drain and buffers are flushed
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_serve_worker(index, inbox))
+
+
+# --- ingestion side ---
+
+class WorkerPool:
+    def __init__(self, size: int):
+        self.size = size
+        self._ctx = multiprocessing.get_context("spawn")
+        self.queues: List[multiprocessing.Queue] = [self._ctx.Queue() for _ in range(size)]
+        self.processes: List[Optional[multiprocessing.Process]] = [None] * size
+        self.routed = 0
+
+    def _worker_env(self, index: int) -> Dict[str, str]:
+        env = {
+            # the global Telegram limit is shared by all workers
+            "OUTBOX_GLOBAL_RATE": str(cfg.OUTBOX_GLOBAL_RATE / self.size),
+            "ADMIN_SYNC_RATE": str(cfg.ADMIN_SYNC_RATE / self.size),
+        }
+        if cfg.METRICS_PORT:
+            env["METRICS_PORT"] = str(cfg.METRICS_PORT + 1 + index)
+        return env
+
+    def _spawn(self, index: int):
+        process = self._ctx.Process(target=_worker_main, args=(index, self.queues[index]), name=f"woxl-worker-{index}")
+        # config is read at import time in the child, so overrides travel in its environment
+        env = self._worker_env(index)
+        saved = {key: os.environ.get(key) for key in env}
+        os.environ.update(env)
+        try:
+            process.start()
+        finally:
+            for key, value in saved.items():
+                if value is None:
+                    os.environ.pop(key, None)
+                else:
+                    os.environ[key] = value
+        self.processes[index] = process
+
+    def start(self):
+        for index in range(self.size):
+            self._spawn(index)
+
+    def route(self, update: Dict[str, Any]):
+        self.queues[chat_key(update) % self.size].put(update)
+        self.routed += 1
+
+    async def supervise(self, interval: float = 1.0):
+        """Restart workers that died; their queue (and its backlog) is picked up by the new process."""
+        while True:
+            await asyncio.sleep(interval)
+            for index, process in enumerate(self.processes):
+                if process is not None and not process.is_alive():
+                    logger.error("Worker %s exited with code %s, restarting", index, process.exitcode)
+                    self._spawn(index)
+
+    async def stop(self, timeout: float = SHUTDOWN_TIMEOUT):
+        loop = asyncio.get_running_loop()
+        for queue in self.queues:
+            queue.put(_STOP)
+        for index, process in enumerate(self.processes):
+            await loop.run_in_executor(None, process.join, timeout)
+            if process.is_alive():
+                logger.warning("Worker %s did not drain in %ss, killing it", index, timeout)
+                # workers ignore SIGTERM
+                process.kill()
+                process.join()
+
+
+async def _poll(dp: Dispatcher, bot: Bot, pool: WorkerPool):
+    allowed_updates = dp.resolve_used_update_types()
+    # the HTTP request has to outlive the long poll
+    request_timeout = int((bot.session.timeout or 0) + POLL_TIMEOUT)
+    offset = None
+    delay = POLL_RETRY_MIN
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=POLL_TIMEOUT, allowed_updates=allowed_updates,
+                                            request_timeout=request_timeout)
+        except Exception as e:
+            logger.error("Failed to fetch updates - %s: %s; retrying in %.0fs", type(e).__name__, e, delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, POLL_RETRY_MAX)
+            continue
+        delay = POLL_RETRY_MIN
+        for update in updates:
+            pool.route(update.model_dump(mode="json", by_alias=True, exclude_none=True))
+            # confirmed with the next getUpdates call
+            offset = update.update_id + 1
+
+
+async def _serve_webhook(dp: Dispatcher, bot: Bot, pool: WorkerPool):
+    secret = cfg.WEBHOOK_SECRET
+
+    async def handle(request: web.Request):
+        if not hmac.compare_digest(request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), secret):
+            return web.Response(status=401, text="Unauthorized")
+        pool.route(await request.json())
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(cfg.WEBHOOK_PATH, handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, cfg.WEBHOOK_HOST, cfg.WEBHOOK_PORT).start()
+    logger.info("Webhook server listening on %s:%s%s", cfg.WEBHOOK_HOST, cfg.WEBHOOK_PORT, cfg.WEBHOOK_PATH)
+    if cfg.WEBHOOK_URL:
+        await bot.set_webhook(cfg.WEBHOOK_URL, secret_token=secret,
+                              allowed_updates=dp.resolve_used_update_types())
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+async def run_partitioned(dp: Dispatcher, bot: Bot):
+    """Receive updates here and handle them in cfg.WORKERS worker processes."""
+    pool = WorkerPool(cfg.WORKERS)
+    pool.start()
+    logger.info("Started %s workers", pool.size)
+
+    receive = _serve_webhook if cfg.UPDATE_MODE == "webhook" else _poll
+    receiver = asyncio.create_task(receive(dp, bot, pool))
+    supervisor = asyncio.create_task(pool.supervise())
+
+    loop = asyncio.get_running_loop()
+    stopping = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+
+    try:
+        await asyncio.wait([receiver, asyncio.create_task(stopping.wait())], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(sig)
+        supervisor.cancel()
+        receiver.cancel()
+        await asyncio.gather(supervisor, receiver, return_exceptions=True)
+        logger.info("Stopping workers after %s routed updates", pool.routed)
+        await pool.stop()